@@ -8,7 +8,16 @@ Core Objects: Agent
 
 
 class Agent:
-    """ Base class for a model agent. """
+    """ Base class for a model agent.
+
+    Properties:
+        passive: Class attribute; True for agent types whose step does
+                 nothing, which schedulers such as RandomActivationByType
+                 then skip.
+
+    """
+    passive = False
+
     def __init__(self, unique_id, model):
         """ Create a new agent. """
         self.unique_id = unique_id
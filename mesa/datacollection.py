@@ -19,25 +19,231 @@ agent in the model scheduler.
 Additionally, other objects can write directly to tables by passing in an
 appropriate dictionary object for a table row.
 
-The DataCollector then stores the data it collects in dictionaries:
+The DataCollector then stores the data it collects:
     * model_vars maps each reporter to a list of its values
-    * agent_vars maps each reporter to a list of lists, where each nested list
-      stores (agent_id, value) pairs.
+    * agent-level data is stored in columns, one row per agent per collection:
+      growable NumPy arrays for the step, the agent_id and each reporter.
+      get_agent_vars_arrays returns views of them; agent_vars rebuilds the
+      older layout, a list per collection of (agent_id, value) pairs.
     * tables maps each table to a dictionary, with each column as a key with a
       list as its value.
 
 Finally, DataCollector can create a pandas DataFrame from each collection.
 
+For long runs, a DataCollector can be given a ChunkedDataSink. Whenever a
+collection holds chunk_size rows, they are handed to a background thread which
+writes them to disk as a numbered .npz chunk, and dropped from memory. Chunks
+are written atomically, so the data of a crashed run can still be read back
+with read_chunks.
+
 The default DataCollector here makes several assumptions:
     * The model has a schedule object called 'schedule'
     * The schedule has an agent list called agents
     * For collecting agent-level variables, agents must have a unique_id
 
 """
-from collections import defaultdict
+import glob
+import os
+import queue
+import threading
+
+import numpy as np
 import pandas as pd
 
 
+class _Column:
+    """ A growable, typed NumPy array.
+
+    Values are appended in batches and stored with the narrowest dtype that
+    fits them all: booleans and numbers keep a numeric dtype (widened as
+    needed), with None among numbers stored as NaN, as pandas reads it;
+    anything else switches the column to object. The capacity
+    doubles when full, so appending is amortized O(1) per value.
+
+    """
+    def __init__(self):
+        self._data = None
+        self._size = 0
+
+    def extend(self, values):
+        """ Append a sequence of values. """
+        if not len(values):
+            return
+        array = self._as_array(values)
+        if self._data is None:
+            self._data = np.empty(max(16, len(array)), dtype=array.dtype)
+        elif array.dtype != self._data.dtype:
+            if array.dtype == object or self._data.dtype == object:
+                dtype = np.dtype(object)
+            else:
+                dtype = np.result_type(self._data.dtype, array.dtype)
+            if dtype != self._data.dtype:
+                self._data = self._data.astype(dtype)
+        end = self._size + len(array)
+        if end > len(self._data):
+            grown = np.empty(max(end, 2 * len(self._data)),
+                             dtype=self._data.dtype)
+            grown[:self._size] = self._data[:self._size]
+            self._data = grown
+        self._data[self._size:end] = array
+        self._size = end
+
+    @staticmethod
+    def _as_array(values):
+        """ Convert values to a 1-d numeric array, or an object array. """
+        array = np.asarray(values)
+        if array.ndim == 1 and array.dtype.kind in "biuf":
+            return array
+        if array.ndim == 1:
+            present = [value is not None for value in values]
+            if not all(present):
+                numbers = np.asarray([value for value in values
+                                      if value is not None])
+                if numbers.ndim == 1 and numbers.dtype.kind in "iuf":
+                    array = np.full(len(present), np.nan)
+                    array[np.array(present, dtype=bool)] = numbers
+                    return array
+        array = np.empty(len(values), dtype=object)
+        for index, value in enumerate(values):
+            array[index] = value
+        return array
+
+    def view(self):
+        """ Return a read-only view of the values. """
+        if self._data is None:
+            return np.empty(0)
+        view = self._data[:self._size]
+        view.flags.writeable = False
+        return view
+
+    def __len__(self):
+        return self._size
+
+
+def read_chunks(directory, kind):
+    """ Read back the chunks of one kind written by a ChunkedDataSink.
+
+    Args:
+        directory: The sink's directory.
+        kind: "model", "agents", or "table-" followed by a table name.
+
+    Returns:
+        A dictionary mapping each column name to a NumPy array with the
+        values of all the chunks, in order; empty if there are none.
+
+    """
+    # Only "<kind>-NNNNNN.npz", so table "Life" leaves "Life-span" alone.
+    pattern = os.path.join(glob.escape(directory),
+                           glob.escape(kind) + "-" + "[0-9]" * 6 + ".npz")
+    parts = {}
+    for path in sorted(glob.glob(pattern)):
+        with np.load(path, allow_pickle=True) as chunk:
+            for name in chunk.files:
+                parts.setdefault(name, []).append(chunk[name])
+    return {name: np.concatenate(arrays) for name, arrays in parts.items()}
+
+
+class ChunkedDataSink:
+    """ Writes collected data to a directory of .npz chunks.
+
+    Each chunk holds the columns of one collection ("model", "agents" or
+    "table-<name>") for a run of rows, and is named after the collection and
+    its sequence number, e.g. agents-000003.npz. Chunks are written on a
+    background thread, first to a temporary file which is then renamed, so
+    a chunk on disk is always complete. At most max_pending chunks wait in
+    memory; beyond that, write blocks until the thread catches up.
+
+    A collection is written out when it holds chunk_size rows, and all of
+    them are whenever the agents are, or at least every flush_every
+    collect calls, so slow-growing collections such as the model variables
+    also reach the disk during the run.
+
+    """
+    def __init__(self, directory, chunk_size=100000, max_pending=4,
+                 flush_every=1000):
+        """ Create a sink writing to a new or empty directory.
+
+        Args:
+            directory: Directory to write the chunks to.
+            chunk_size: Number of rows a collection buffers before they are
+                        written out.
+            max_pending: Number of chunks which may wait to be written.
+            flush_every: Number of collect calls after which every
+                         collection is written out, whatever its size.
+
+        """
+        os.makedirs(directory, exist_ok=True)
+        if glob.glob(os.path.join(glob.escape(directory), "*.npz")):
+            raise Exception("ERROR: Directory already holds data chunks")
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.flush_every = flush_every
+        self._queue = queue.Queue(max_pending)
+        self._sequences = {}
+        self._error = None
+        self.closed = False
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def write(self, kind, columns):
+        """ Queue a chunk of columns, a dictionary of equal-length arrays. """
+        if self.closed:
+            raise Exception("ERROR: Cannot write to a closed sink")
+        self._check()
+        sequence = self._sequences.get(kind, 0)
+        self._sequences[kind] = sequence + 1
+        self._queue.put((kind, sequence, columns))
+
+    def read(self, kind):
+        """ Wait for the queued chunks, then read back one kind. """
+        self.join()
+        return read_chunks(self.directory, kind)
+
+    def join(self):
+        """ Wait until every queued chunk is on disk. """
+        self._queue.join()
+        self._check()
+
+    def close(self):
+        """ Write the queued chunks and stop the writer thread. The chunks
+        can still be read afterwards, but no more can be written. """
+        self.closed = True
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._check()
+
+    def _check(self):
+        """ Raise the error the writer thread stopped on, if any. """
+        if self._error is not None:
+            raise self._error
+
+    def _write_loop(self):
+        """ Writer thread: save queued chunks until told to stop. """
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if self._error is None:
+                    self._save(*item)
+            except Exception as error:
+                self._error = error
+            finally:
+                self._queue.task_done()
+
+    def _save(self, kind, sequence, columns):
+        """ Write one chunk atomically. """
+        path = os.path.join(self.directory,
+                            "{}-{:06d}.npz".format(kind, sequence))
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as chunk_file:
+            np.savez(chunk_file, **columns)
+            chunk_file.flush()
+            os.fsync(chunk_file.fileno())
+        os.replace(temporary, path)
+
+
 class DataCollector:
     """ Class for collecting data generated by a Mesa model.
 
@@ -50,7 +256,8 @@ class DataCollector:
 
     model = None
 
-    def __init__(self, model_reporters={}, agent_reporters={}, tables={}):
+    def __init__(self, model_reporters={}, agent_reporters={}, tables={},
+                 sink=None):
         """ Instantiate a DataCollector with lists of model and agent reporters.
 
         Both model_reporters and agent_reporters accept a dictionary mapping a
@@ -71,14 +278,33 @@ class DataCollector:
         Args:
             model_reporters: Dictionary of reporter names and functions.
             agent_reporters: Dictionary of reporter names and functions.
+            tables: Dictionary of table names and lists of columns.
+            sink: Optional ChunkedDataSink to stream the data to. Then only
+                  the rows not yet written are kept in memory (in model_vars,
+                  tables and agent_vars), while the get_*_dataframe methods
+                  read everything back. model_vars always keeps at least the
+                  latest row, for charts. Call close() at the end of the run.
 
         """
         self.model_reporters = {}
         self.agent_reporters = {}
 
         self.model_vars = {}
-        self.agent_vars = {}
         self.tables = {}
+        self.sink = sink
+
+        # Agent-level columns, and the first row of each collection in them.
+        self._agent_steps = _Column()
+        self._agent_ids = _Column()
+        self._agent_columns = {}
+        self._collection_starts = []
+        # Collections made, and model rows already written to the sink, of
+        # which the first _model_rows_kept are still in model_vars.
+        self._agent_collections = 0
+        self._model_rows_written = 0
+        self._model_rows_kept = 0
+        # collect calls since everything was last written.
+        self._unflushed_collects = 0
 
         for name, func in model_reporters.items():
             self._new_model_reporter(name, func)
@@ -111,7 +337,7 @@ class DataCollector:
 
         """
         self.agent_reporters[reporter_name] = reporter_function
-        self.agent_vars[reporter_name] = []
+        self._agent_columns[reporter_name] = _Column()
 
     def _new_table(self, table_name, table_columns):
         """ Add a new table that objects can write to.
@@ -131,11 +357,88 @@ class DataCollector:
                 self.model_vars[var].append(reporter(model))
 
         if self.agent_reporters:
+            agents = list(model.schedule.agents)
+            step = self._agent_collections
+            self._agent_collections += 1
+            self._collection_starts.append(len(self._agent_ids))
+            self._agent_steps.extend(np.full(len(agents), step,
+                                             dtype=np.int64))
+            self._agent_ids.extend([agent.unique_id for agent in agents])
             for var, reporter in self.agent_reporters.items():
-                agent_records = []
-                for agent in model.schedule.agents:
-                    agent_records.append((agent.unique_id, reporter(agent)))
-                self.agent_vars[var].append(agent_records)
+                self._agent_columns[var].extend(
+                    [reporter(agent) for agent in agents])
+
+        if self.sink is not None:
+            self._unflushed_collects += 1
+            if self._unflushed_collects >= self.sink.flush_every:
+                self._write(1)
+            else:
+                self._write(self.sink.chunk_size)
+
+    def _write(self, min_rows):
+        """ Hand the buffered rows of each collection holding at least
+        min_rows rows over to the sink, and drop them from memory. When the
+        agents are written, everything else is too. """
+        agent_rows = len(self._agent_ids)
+        if agent_rows and agent_rows >= min_rows:
+            self.sink.write("agents", self.get_agent_vars_arrays())
+            self._agent_steps = _Column()
+            self._agent_ids = _Column()
+            for var in self._agent_columns:
+                self._agent_columns[var] = _Column()
+            self._collection_starts = []
+            min_rows = 1
+
+        kept = self._model_rows_kept
+        model_rows = len(next(iter(self.model_vars.values()), ())) - kept
+        if model_rows > 0 and model_rows >= min_rows:
+            start = self._model_rows_written
+            columns = {"Step": np.arange(start, start + model_rows)}
+            for var, values in self.model_vars.items():
+                columns[var] = _Column._as_array(values[kept:])
+                del values[:-1]
+            self.sink.write("model", columns)
+            self._model_rows_written += model_rows
+            self._model_rows_kept = 1
+
+        for name, table in self.tables.items():
+            table_rows = len(next(iter(table.values()), ()))
+            if table_rows and table_rows >= min_rows:
+                self.sink.write("table-" + name,
+                                {column: _Column._as_array(values)
+                                 for column, values in table.items()})
+                for values in table.values():
+                    del values[:]
+
+        if min_rows == 1:
+            self._unflushed_collects = 0
+
+    def flush(self):
+        """ Write all buffered rows to the sink and wait until they are on
+        disk. """
+        if self.sink is not None:
+            self._write(1)
+            self.sink.join()
+
+    def close(self):
+        """ Write all buffered rows to the sink and stop its writer. """
+        if self.sink is not None:
+            self._write(1)
+            self.sink.close()
+
+    @property
+    def agent_vars(self):
+        """ The agent variables in the older layout: a dictionary mapping
+        each reporter to a list, per collection, of (agent_id, value) pairs.
+        Built on each access; prefer get_agent_vars_arrays. """
+        ids = self._agent_ids.view().tolist()
+        bounds = self._collection_starts + [len(ids)]
+        agent_vars = {}
+        for var, column in self._agent_columns.items():
+            values = column.view().tolist()
+            agent_vars[var] = [list(zip(ids[start:end], values[start:end]))
+                               for start, end in zip(bounds, bounds[1:])]
+        return agent_vars
 
     def add_table_row(self, table_name, row, ignore_missing=False):
         """ Add a row dictionary to a specific table.
@@ -158,6 +461,9 @@ class DataCollector:
             else:
                 raise Exception("Could not insert row with missing column")
 
+        if self.sink is not None:
+            self._write(self.sink.chunk_size)
+
     def get_model_vars_dataframe(self):
         """ Create a pandas DataFrame from the model variables.
 
@@ -165,25 +471,48 @@ class DataCollector:
         (implicitly) the model tick.
 
         """
+        if self.sink is not None:
+            self.flush()
+            columns = self.sink.read("model")
+            return pd.DataFrame(columns, columns=list(self.model_reporters),
+                                index=columns.get("Step"))
         return pd.DataFrame(self.model_vars)
 
     def get_agent_vars_dataframe(self):
         """ Create a pandas DataFrame from the agent variables.
 
-        The DataFrame has one column for each variable, with two additional
-        columns for tick and agent_id.
+        The DataFrame has one column for each variable, indexed by the
+        collection step and the agent_id.
+
+        """
+        if self.sink is not None:
+            self.flush()
+            arrays = self.sink.read("agents")
+            if not arrays:
+                return pd.DataFrame(columns=list(self.agent_reporters))
+        else:
+            arrays = self.get_agent_vars_arrays()
+        index = pd.MultiIndex.from_arrays([arrays.pop("Step"),
+                                           arrays.pop("AgentID")],
+                                          names=["Step", "AgentID"])
+        return pd.DataFrame(arrays, index=index)
+
+    def get_agent_vars_arrays(self):
+        """ Return the agent variables as read-only NumPy arrays, without
+        copying them. With a sink, only the rows not yet written are
+        returned; use read_chunks for the others.
+
+        Returns:
+            A dictionary with a "Step" and an "AgentID" array, and an array
+            for each agent reporter, all with one entry per agent per
+            collection.
 
         """
-        data = defaultdict(dict)
-        for var, records in self.agent_vars.items():
-            for step, entries in enumerate(records):
-                for entry in entries:
-                    agent_id = entry[0]
-                    val = entry[1]
-                    data[(step, agent_id)][var] = val
-        df = pd.DataFrame.from_dict(data, orient="index")
-        df.index.names = ["Step", "AgentID"]
-        return df
+        arrays = {"Step": self._agent_steps.view(),
+                  "AgentID": self._agent_ids.view()}
+        for var, column in self._agent_columns.items():
+            arrays[var] = column.view()
+        return arrays
 
     def get_table_dataframe(self, table_name):
         """ Create a pandas DataFrame from a particular table.
@@ -194,4 +523,8 @@ class DataCollector:
         """
         if table_name not in self.tables:
             raise Exception("No such table.")
+        if self.sink is not None:
+            self.flush()
+            return pd.DataFrame(self.sink.read("table-" + table_name),
+                                columns=list(self.tables[table_name]))
         return pd.DataFrame(self.tables[table_name])
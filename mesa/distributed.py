@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""
+Mesa Distributed Module
+=======================
+
+Run a model on a large grid as several tiles, each owned by a local worker
+process.
+
+The grid is cut into strips along one axis. Every tile runs its own copy of
+the model, with its own scheduler, on a SparseMultiGrid spanning the whole
+map, so agent code keeps using global coordinates. After each tick,
+neighboring tiles exchange:
+
+    Migrants: agents which moved out of a tile are removed from it and added,
+    with their scheduler, to the tile they moved into.
+
+    Ghosts: copies of the agents within halo cells of a boundary are placed
+    on the neighbor's grid, but not scheduled, so agents near the boundary
+    see what is across it. They are replaced every tick and must be treated
+    as read-only.
+
+Agents travel between processes pickled, with their model reference
+detached and reattached on arrival, so they should only hold plain data
+(no references to other agents). Their unique_ids must be unique across
+all tiles, e.g. drawn from Tile.next_id. An agent must not move further
+than halo cells, nor across more than one boundary, in a tick.
+
+If a worker raises an exception, the runner stops all the workers and
+raises it in the parent process.
+
+Core Objects: Tile, DistributedRunner
+
+"""
+import multiprocessing
+import multiprocessing.connection
+import pickle
+import random
+import traceback
+
+import numpy as np
+
+from mesa.space import SparseMultiGrid
+
+
+class Tile:
+    """ The part of the grid a worker process owns.
+
+    Properties:
+        index, count: Position of the tile among the tiles, and their number.
+        width, height: Size of the whole grid.
+        axis: 0 if the grid is cut along x (vertical strips), 1 along y.
+        lower, upper: The tile owns the cells whose coordinate on axis is in
+                      [lower, upper).
+        halo: Width, in cells, of the border copied to neighbor tiles.
+        seed: Seed of the random number generators of the tile's process.
+        model: The tile's model, once created.
+
+    """
+    def __init__(self, index, count, width, height, axis, lower, upper,
+                 halo, seed):
+        self.index = index
+        self.count = count
+        self.width = width
+        self.height = height
+        self.axis = axis
+        self.lower = lower
+        self.upper = upper
+        self.halo = halo
+        self.seed = seed
+        self.model = None
+        self._ghosts = []
+        self._ids = 0
+        # Pipes to the previous and the next tile, or None at the ends.
+        self._neighbors = (None, None)
+
+    def owns(self, pos):
+        """ Returns whether a cell belongs to this tile. """
+        return self.lower <= pos[self.axis] < self.upper
+
+    def cells(self):
+        """ Iterate over the (x, y) cells owned by this tile. """
+        other = self.height if self.axis == 0 else self.width
+        for a in range(self.lower, self.upper):
+            for b in range(other):
+                yield (a, b) if self.axis == 0 else (b, a)
+
+    def next_id(self):
+        """ Return a new unique_id, unique across all the tiles: tile i hands
+        out i, i + count, i + 2 * count, and so on. """
+        unique_id = self.index + self._ids * self.count
+        self._ids += 1
+        return unique_id
+
+    def make_grid(self, layer_types=()):
+        """ Create the tile's grid: a SparseMultiGrid over the whole map,
+        which only holds this tile's agents and the ghosts. """
+        return SparseMultiGrid(self.width, self.height, False, layer_types)
+
+    def exchange(self):
+        """ Send migrants to the neighbor tiles and take in theirs, then do
+        the same with ghosts, so ghosts reflect the new owners. """
+        model = self.model
+        for ghost in self._ghosts:
+            model.grid.remove_agent(ghost)
+        self._ghosts = []
+
+        axis, lower, upper, halo = self.axis, self.lower, self.upper, self.halo
+        migrants = ([], [])
+        for agent in list(model.schedule.agents):
+            if agent.pos is None:
+                continue
+            if agent.pos[axis] < lower:
+                migrants[0].append(agent)
+            elif agent.pos[axis] >= upper:
+                migrants[1].append(agent)
+        for side in migrants:
+            for agent in side:
+                pos = agent.pos
+                model.grid.remove_agent(agent)
+                model.schedule.remove(agent)
+                agent.pos = pos
+        for agents in self._swap(migrants):
+            for agent in agents:
+                if not self.owns(agent.pos):
+                    raise Exception("ERROR: Agent {} moved across more than "
+                                    "one tile in a tick".format(
+                                        agent.unique_id))
+                agent.model = model
+                model.grid.place_agent(agent, agent.pos)
+                model.schedule.add(agent)
+
+        ghosts = ([], [])
+        for agent in model.schedule.agents:
+            if agent.pos is None:
+                continue
+            if agent.pos[axis] < lower + halo:
+                ghosts[0].append(agent)
+            if agent.pos[axis] >= upper - halo:
+                ghosts[1].append(agent)
+        for agents in self._swap(ghosts):
+            for ghost in agents:
+                ghost.model = model
+                model.grid.place_agent(ghost, ghost.pos)
+                self._ghosts.append(ghost)
+
+    def _swap(self, outgoing):
+        """ Send a list of agents to each neighbor and receive theirs.
+
+        Boundaries are handled in two phases, first those after even tiles
+        and then those after odd ones, and on each boundary the lower tile
+        sends first, so the pipes never deadlock.
+
+        Returns:
+            The agents received from the previous and the next tile.
+
+        """
+        incoming = ([], [])
+        for phase in (0, 1):
+            side = 1 if self.index % 2 == phase else 0
+            pipe = self._neighbors[side]
+            if pipe is None:
+                continue
+            if side == 1:
+                pipe.send_bytes(self._pack(outgoing[side]))
+                incoming[side].extend(pickle.loads(pipe.recv_bytes()))
+            else:
+                incoming[side].extend(pickle.loads(pipe.recv_bytes()))
+                pipe.send_bytes(self._pack(outgoing[side]))
+        return incoming
+
+    @staticmethod
+    def _pack(agents):
+        """ Pickle agents without their model. """
+        models = [agent.model for agent in agents]
+        for agent in agents:
+            agent.model = None
+        try:
+            return pickle.dumps(agents, pickle.HIGHEST_PROTOCOL)
+        finally:
+            for agent, model in zip(agents, models):
+                agent.model = model
+
+
+def _run_tile(model_class, model_kwargs, tile, control, neighbors):
+    """ Worker process: build the tile's model and serve commands.
+
+    Replies are ("ok", result), or ("error", traceback) after which the
+    worker exits.
+
+    """
+    try:
+        random.seed(tile.seed)
+        np.random.seed(tile.seed % 2 ** 32)
+        tile._neighbors = neighbors
+        tile.model = model_class(tile, **model_kwargs)
+        tile.exchange()
+        while True:
+            command, argument = control.recv()
+            if command == "step":
+                for _ in range(argument):
+                    tile.model.step()
+                    tile.exchange()
+                control.send(("ok", tile.model.schedule.get_agent_count()))
+            elif command == "call":
+                control.send(("ok", argument(tile.model)))
+            else:
+                break
+    except Exception:
+        control.send(("error", traceback.format_exc()))
+
+
+class DistributedRunner:
+    """ Runs a model as tiles in local worker processes.
+
+    The model class is created once per tile, as model_class(tile,
+    **model_kwargs). It should build its grid with tile.make_grid(), use a
+    scheduler such as RandomActivation, and only create agents on the
+    cells the tile owns (see Tile.owns and Tile.cells), with unique_ids
+    that are unique across all tiles (see Tile.next_id). Its step method is
+    called once per tick, after which the tiles exchange migrants and
+    ghosts.
+
+    """
+    def __init__(self, model_class, width, height, tiles=None, axis=0,
+                 halo=1, seed=None, **model_kwargs):
+        """ Start one worker process per tile.
+
+        Args:
+            model_class: Model class taking a Tile as first argument.
+            width, height: Size of the whole grid.
+            tiles: Number of tiles; by default one per CPU.
+            axis: 0 to cut the grid along x, 1 along y.
+            halo: Width in cells of the border shared with each neighbor.
+                  Also the furthest an agent may move in a tick.
+            seed: Base seed; tile i seeds its generators with seed + i.
+            model_kwargs: Passed on to model_class.
+
+        """
+        size = width if axis == 0 else height
+        tiles = tiles or multiprocessing.cpu_count()
+        bounds = np.linspace(0, size, tiles + 1).astype(int)
+        if np.diff(bounds).min() <= halo:
+            raise Exception("ERROR: Tiles must be wider than the halo")
+        if seed is None:
+            seed = random.getrandbits(32)
+
+        self.width = width
+        self.height = height
+        self.steps = 0
+        self.tiles = [Tile(index, tiles, width, height, axis,
+                           int(bounds[index]), int(bounds[index + 1]), halo,
+                           seed + index)
+                      for index in range(tiles)]
+        links = [multiprocessing.Pipe() for _ in range(tiles - 1)]
+        self._controls = []
+        self._processes = []
+        for index, tile in enumerate(self.tiles):
+            control, remote = multiprocessing.Pipe()
+            neighbors = (links[index - 1][1] if index > 0 else None,
+                         links[index][0] if index < tiles - 1 else None)
+            process = multiprocessing.Process(
+                target=_run_tile,
+                args=(model_class, model_kwargs, tile, remote, neighbors),
+                daemon=True)
+            process.start()
+            self._controls.append(control)
+            self._processes.append(process)
+
+    def step(self, steps=1):
+        """ Advance all the tiles by the given number of ticks.
+
+        Returns:
+            The number of scheduled agents in each tile.
+
+        """
+        for control in self._controls:
+            control.send(("step", steps))
+        counts = self._receive()
+        self.steps += steps
+        return counts
+
+    def call(self, function):
+        """ Call function(model) in every tile, e.g. to collect data.
+
+        The function must be picklable, e.g. defined at module level.
+
+        Returns:
+            The list of results, one per tile.
+
+        """
+        for control in self._controls:
+            control.send(("call", function))
+        return self._receive()
+
+    def _receive(self):
+        """ Collect one reply from each tile.
+
+        Replies are awaited in whatever order they come, so that an error
+        in one tile is seen even while its neighbors are stuck waiting for
+        it; the workers are then stopped and the error raised.
+
+        """
+        if not self._controls:
+            raise Exception("ERROR: The runner is closed")
+        replies = {}
+        waiting = dict(enumerate(self._controls))
+        while waiting:
+            ready = multiprocessing.connection.wait(
+                list(waiting.values()) +
+                [self._processes[index].sentinel for index in waiting])
+            for index, control in list(waiting.items()):
+                process = self._processes[index]
+                if control not in ready and process.sentinel not in ready:
+                    continue
+                del waiting[index]
+                if control.poll():
+                    status, result = control.recv()
+                else:
+                    status, result = "error", "Worker exited"
+                if status == "error":
+                    self._terminate()
+                    raise Exception("ERROR: Tile {} failed:\n{}".format(
+                        index, result))
+                replies[index] = result
+        return [replies[index] for index in range(len(self._controls))]
+
+    def _terminate(self):
+        """ Stop the worker processes without waiting for them to finish. """
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            process.join()
+        self._controls = []
+        self._processes = []
+
+    def get_agent_count(self):
+        """ Returns the number of scheduled agents over all tiles. """
+        return sum(self.call(_agent_count))
+
+    def close(self):
+        """ Stop the worker processes. """
+        for control in self._controls:
+            control.send(("close", None))
+        for process in self._processes:
+            process.join()
+        self._controls = []
+        self._processes = []
+
+
+def _agent_count(model):
+    return model.schedule.get_agent_count()
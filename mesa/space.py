@@ -7,13 +7,19 @@ Objects used to add a spatial component to a model.
 
 Grid: base grid, a simple list-of-lists.
 SingleGrid: grid which strictly enforces one object per cell.
+CompactSingleGrid: SingleGrid stored in NumPy arrays rather than lists.
 MultiGrid: extension to Grid where each cell is a set of objects.
+SparseMultiGrid: MultiGrid which only stores the cells holding objects.
+GridListener: base class for objects following placements and moves.
+NetworkSpace: space whose locations are the nodes of a graph.
 
 """
 # Instruction for PyLint to suppress variable name errors, since we have a
 # good reason to use one-character variable names for x and y.
 # pylint: disable=invalid-name
 
+import array
+import functools
 import itertools
 import numpy as np
 import random
@@ -26,14 +32,316 @@ def accept_tuple_argument(wrapped_function):
     single-item list rather than forcing user to do it.
 
     """
-    def wrapper(*args):
+    def wrapper(*args, **kwargs):
         if isinstance(args[1], tuple) and len(args[1]) == 2:
-            return wrapped_function(args[0], [args[1]])
+            return wrapped_function(args[0], [args[1]], *args[2:], **kwargs)
         else:
-            return wrapped_function(*args)
+            return wrapped_function(*args, **kwargs)
     return wrapper
 
 
+@functools.lru_cache(maxsize=None)
+def _neighborhood_offsets(moore, include_center, radius):
+    """ Return the (dx, dy) offsets of a neighborhood, in scan order.
+
+    The offsets only depend on the neighborhood shape, so they are computed
+    once per (moore, include_center, radius) and shared by every grid.
+
+    """
+    offsets = []
+    for dy in range(-radius, radius + 1):
+        for dx in range(-radius, radius + 1):
+            if dx == 0 and dy == 0 and not include_center:
+                continue
+            # Skip diagonals in Von Neumann neighborhood.
+            if not moore and dy != 0 and dx != 0:
+                continue
+            # Skip diagonals in Moore neighborhood when distance > radius
+            if moore and radius > 1 and (dy ** 2 + dx ** 2) ** .5 > radius:
+                continue
+            offsets.append((dx, dy))
+    return tuple(offsets)
+
+
+def _concat_ranges(starts, ends):
+    """ Concatenate the integer ranges [start, end) into a single array. """
+    lengths = ends - starts
+    total = lengths.sum()
+    if not total:
+        return np.empty(0, dtype=int)
+    shifts = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return shifts + np.arange(total)
+
+
+class _Fenwick2D:
+    """ A 2-D Fenwick (binary indexed) tree over per-cell counts.
+
+    Adding to one cell and summing a rectangle both cost O(log W * log H),
+    so the tree can follow every placement and removal and still answer
+    rectangle counts quickly between moves. The tree is a flat array of
+    Python-sized ints, (width + 1) x (height + 1), with a zero border.
+
+    """
+    def __init__(self, counts):
+        """ Build the tree from a (width, height) array of counts in one
+        vectorized pass, via the summed-area table. """
+        width, height = counts.shape
+        table = np.zeros((width + 1, height + 1), dtype=np.int64)
+        np.cumsum(counts, axis=0, out=table[1:, 1:])
+        np.cumsum(table[1:, 1:], axis=1, out=table[1:, 1:])
+        # Node (i, j) sums the cells (i - lowbit(i), i] x (j - lowbit(j), j].
+        i = np.arange(1, width + 1)[:, None]
+        j = np.arange(1, height + 1)[None, :]
+        low_i = i - (i & -i)
+        low_j = j - (j & -j)
+        tree = np.zeros_like(table)
+        tree[1:, 1:] = (table[i, j] - table[low_i, j] - table[i, low_j] +
+                        table[low_i, low_j])
+        self.width = width
+        self.height = height
+        self._stride = height + 1
+        self._tree = array.array("q", tree.tobytes())
+
+    def add(self, x, y, delta):
+        """ Add delta to the count of cell (x, y). """
+        tree = self._tree
+        stride, height = self._stride, self.height
+        i = x + 1
+        while i <= self.width:
+            row = i * stride
+            j = y + 1
+            while j <= height:
+                tree[row + j] += delta
+                j += j & -j
+            i += i & -i
+
+    def _prefix(self, i, j):
+        """ Sum the cells x < i, y < j. """
+        tree = self._tree
+        stride = self._stride
+        total = 0
+        while i > 0:
+            row = i * stride
+            k = j
+            while k > 0:
+                total += tree[row + k]
+                k -= k & -k
+            i -= i & -i
+        return total
+
+    def count(self, x0, y0, x1, y1):
+        """ Sum the cells in an inclusive, in-bounds rectangle. """
+        return (self._prefix(x1 + 1, y1 + 1) - self._prefix(x0, y1 + 1) -
+                self._prefix(x1 + 1, y0) + self._prefix(x0, y0))
+
+
+def _bulk_arguments(agents, positions):
+    """ Check and normalize the arguments of a bulk placement.
+
+    Returns the agents as a list, and the positions as a list of (x, y)
+    tuples of Python ints.
+
+    """
+    agents = list(agents)
+    positions = [tuple(pos) for pos in
+                 np.asarray(positions, dtype=int).reshape(-1, 2).tolist()]
+    if len(agents) != len(positions):
+        raise Exception("ERROR: Need exactly one position per agent")
+    return agents, positions
+
+
+# Distance functions for Grid.nearest, taking the x and y offsets.
+_GRID_METRICS = {
+    "manhattan": lambda dx, dy: dx + dy,
+    "chebyshev": max,
+    "euclidean": math.hypot,
+}
+
+
+class _EmptyCells:
+    """ Index of the empty cells of a grid.
+
+    Cells are kept both in a list, for uniform random picks, and in a dict
+    mapping each cell to its slot in that list, for membership tests. A cell
+    is removed by moving the last cell into its slot, so add, discard and
+    choice all run in constant time.
+
+    """
+    def __init__(self, cells=()):
+        self._cells = list(cells)
+        self._slots = {pos: slot for slot, pos in enumerate(self._cells)}
+
+    def add(self, pos):
+        """ Mark a cell as empty. """
+        if pos not in self._slots:
+            self._slots[pos] = len(self._cells)
+            self._cells.append(pos)
+
+    def discard(self, pos):
+        """ Mark a cell as occupied, if it was empty. """
+        slot = self._slots.pop(pos, None)
+        if slot is None:
+            return
+        last = self._cells.pop()
+        if slot < len(self._cells):
+            self._cells[slot] = last
+            self._slots[last] = slot
+
+    def choice(self):
+        """ Pick a random empty cell. """
+        return random.choice(self._cells)
+
+    def __contains__(self, pos):
+        return pos in self._slots
+
+    def __len__(self):
+        return len(self._cells)
+
+    def __iter__(self):
+        return iter(self._cells)
+
+    def __getitem__(self, index):
+        return self._cells[index]
+
+
+class _ArrayEmptyCells:
+    """ Index of the empty cells of a grid, stored in NumPy arrays.
+
+    Same interface as _EmptyCells, without a Python tuple per cell. Cells are
+    numbered x * height + y; the empty ones are the first `count` entries of
+    a permutation of all cell numbers, and a second array holds each cell's
+    slot in that permutation.
+
+    """
+    def __init__(self, width, height):
+        self._height = height
+        self._cells = np.arange(width * height, dtype=np.int32)
+        self._slots = np.arange(width * height, dtype=np.int32)
+        self._count = width * height
+
+    def _swap(self, slot, other_slot):
+        """ Exchange the cells at two slots of the permutation. """
+        cell = self._cells[slot]
+        other = self._cells[other_slot]
+        self._cells[slot] = other
+        self._cells[other_slot] = cell
+        self._slots[other] = slot
+        self._slots[cell] = other_slot
+
+    def add(self, pos):
+        """ Mark a cell as empty. """
+        x, y = pos
+        slot = self._slots[x * self._height + y]
+        if slot >= self._count:
+            self._swap(slot, self._count)
+            self._count += 1
+
+    def discard(self, pos):
+        """ Mark a cell as occupied, if it was empty. """
+        x, y = pos
+        slot = self._slots[x * self._height + y]
+        if slot < self._count:
+            self._count -= 1
+            self._swap(slot, self._count)
+
+    def choice(self):
+        """ Pick a random empty cell. """
+        return self[random.randrange(self._count)]
+
+    def __contains__(self, pos):
+        x, y = pos
+        return self._slots[x * self._height + y] < self._count
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for cell in self._cells[:self._count].tolist():
+            yield divmod(cell, self._height)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("empty cell index out of range")
+        return divmod(int(self._cells[index]), self._height)
+
+
+class _SparseEmptyCells:
+    """ Index of the empty cells of a SparseMultiGrid.
+
+    Every open cell the grid does not store is empty, so there is nothing to
+    keep up to date: add and discard are no-ops, and random picks sample
+    cells until they find one that is not stored.
+
+    """
+    def __init__(self, grid):
+        self._grid = grid
+
+    def add(self, pos):
+        """ Nothing to do; a cell is empty once the grid drops it. """
+
+    def discard(self, pos):
+        """ Nothing to do; a cell is occupied once the grid stores it. """
+
+    def choice(self):
+        """ Pick a random empty cell. """
+        grid = self._grid
+        for _ in range(64):
+            pos = (random.randrange(grid.width), random.randrange(grid.height))
+            if pos in self:
+                return pos
+        # The grid is nearly full; pick among the empty cells directly.
+        return random.choice(list(self))
+
+    def __contains__(self, pos):
+        x, y = pos
+        grid = self._grid
+        return (0 <= x < grid.width and 0 <= y < grid.height and
+                (x, y) not in grid._cells and
+                (grid.terrain is None or not grid.terrain[x, y]))
+
+    def __len__(self):
+        grid = self._grid
+        # Blocked cells are not empty, unless already counted as stored.
+        return (grid.width * grid.height - len(grid._cells) -
+                grid._blocked_cells + grid._blocked_stored)
+
+    def __iter__(self):
+        for pos in itertools.product(range(self._grid.width),
+                                     range(self._grid.height)):
+            if pos in self:
+                yield pos
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("empty cell index out of range")
+        return next(itertools.islice(self, index, None))
+
+
+class GridListener:
+    """ Base class for objects following the agents on a grid.
+
+    Register instances with Grid.add_listener to keep derived data, such as
+    influence maps or heatmaps, in step with the grid one event at a time.
+    Every method is a no-op here; override the ones you need.
+
+    """
+    def on_place(self, agent, pos):
+        """ Called after agent was placed at pos. """
+        pass
+
+    def on_move(self, agent, old_pos, new_pos):
+        """ Called after agent moved from old_pos to new_pos. """
+        pass
+
+    def on_remove(self, agent, pos):
+        """ Called after agent was removed from pos. """
+        pass
+
+
 class Grid:
     """ Base class for a square grid.
 
@@ -45,15 +353,25 @@ class Grid:
         width, height: The grid's width and height.
         torus: Boolean which determines whether to treat the grid as a torus.
         grid: Internal list-of-lists which holds the grid cells themselves.
+        empties: Index of the empty cells, as (x, y) tuples. Blocked cells
+                 are never listed.
+        occupancy: NumPy array, indexed [x, y], with the number of agents in
+                   each cell.
+        terrain: NumPy uint8 array, indexed [x, y], with the static type of
+                 each cell: 0 for open ground, anything else blocks movement.
+                 None until set_terrain is first called.
 
     Methods:
         get_neighbors: Returns the objects surrounding a given cell.
         get_neighborhood: Returns the cells surrounding a given cell.
+        get_neighborhoods: Returns the cells surrounding many cells at once,
+        as padded arrays.
         get_cell_list_contents: Returns the contents of a list of cells
             ((x,y) tuples)
         neighbor_iter: Iterates over position neightbors.
         coord_iter: Returns coordinates as well as cell contents.
         place_agent: Positions an agent on the grid, and set its pos variable.
+        place_agents: Positions many agents on the grid in one pass.
         move_agent: Moves an agent from its current position to a new position.
         iter_neighborhood: Returns an iterator over cell coordinates that are
         in the neighborhood of a certain point.
@@ -65,7 +383,20 @@ class Grid:
         get_cell_list_contents: Returns a list of the contents of the cells
         identified in cell_list.
         remove_agent: Removes an agent from the grid.
+        remove_agents: Removes many agents from the grid in one pass.
         is_cell_empty: Returns a bool of the contents of a cell.
+        set_terrain: Sets the static terrain type of cells.
+        is_passable: Returns whether a cell's terrain is open.
+        passable_mask: Returns a bool array of the open cells.
+        count_agents: Returns the number of agents in a rectangle of cells.
+        count_agents_in: Returns the number of agents in a list of cells.
+        nearest: Returns the agents of a type nearest to a cell.
+        add_listener: Registers an object to be told about agent placements,
+        moves and removals.
+        remove_listener: Unregisters a listener.
+        checkpoint: Starts journaling changes so they can be rolled back.
+        rollback: Undoes the changes since the last checkpoint.
+        commit: Keeps the changes since the last checkpoint.
 
     """
     def __init__(self, width, height, torus):
@@ -80,6 +411,22 @@ class Grid:
         self.width = width
         self.torus = torus
 
+        # Neighborhood tuples, keyed by shape and then by cell.
+        self._neighborhood_cache = {}
+        # Fenwick trees of the counts, keyed by layer (None for all agents);
+        # built on the first count_agents query, then kept up to date.
+        self._fenwicks = {}
+        self._listeners = []
+        # Undo journal of (operation, agent, previous pos), and where each
+        # open checkpoint starts in it. None while there is no checkpoint.
+        self._journal = None
+        self._checkpoints = []
+        self.terrain = None
+
+        self._build_cells()
+
+    def _build_cells(self):
+        """ Create the cell storage, the empties index and the occupancy. """
         self.grid = []
 
         for x in range(self.width):
@@ -88,9 +435,10 @@ class Grid:
                 col.append(self.default_val())
             self.grid.append(col)
 
-        # Add all cells to the empties list.
-        self.empties = list(itertools.product(
-                            *(range(self.width), range(self.height))))
+        # Add all cells to the empties index.
+        self.empties = _EmptyCells(itertools.product(
+                                   *(range(self.width), range(self.height))))
+        self.occupancy = np.zeros((self.width, self.height), dtype=np.int32)
 
     @staticmethod
     def default_val():
@@ -124,7 +472,8 @@ class Grid:
         return self.iter_cell_list_contents(neighborhood)
 
     def iter_neighborhood(self, pos, moore,
-                          include_center=False, radius=1):
+                          include_center=False, radius=1,
+                          passable_only=False):
         """ Return an iterator over cell coordinates that are in the
         neighborhood of a certain point.
 
@@ -137,6 +486,7 @@ class Grid:
             include_center: If True, return the (x, y) cell as well.
                             Otherwise, return surrounding cells only.
             radius: radius, in cells, of neighborhood to get.
+            passable_only: If True, skip cells whose terrain is blocked.
 
         Returns:
             A list of coordinate tuples representing the neighborhood. For
@@ -145,37 +495,68 @@ class Grid:
             including the center).
 
         """
-        x, y = pos
-        coordinates = set()
-        for dy in range(-radius, radius + 1):
-            for dx in range(-radius, radius + 1):
-                if dx == 0 and dy == 0 and not include_center:
-                    continue
-                # Skip diagonals in Von Neumann neighborhood.
-                if not moore and dy != 0 and dx != 0:
-                    continue
-                # Skip diagonals in Moore neighborhood when distance > radius
-                if moore and radius > 1 and (dy ** 2 + dx ** 2) ** .5 > radius:
-                    continue
-                # Skip if not a torus and new coords out of bounds.
-                if not self.torus and (not (0 <= dx + x < self.width) or
-                                       not (0 <= dy + y < self.height)):
-                    continue
-
-                px = self.torus_adj(x + dx, self.width)
-                py = self.torus_adj(y + dy, self.height)
-
-                # Skip if new coords out of bounds.
-                if(self.out_of_bounds((px, py))):
-                    continue
-
-                coords = (px, py)
-                if coords not in coordinates:
-                    coordinates.add(coords)
-                    yield coords
+        return iter(self._neighborhood(pos, moore, include_center, radius,
+                                       passable_only))
+
+    def _neighborhood(self, pos, moore, include_center, radius,
+                      passable_only=False):
+        """ Return the neighborhood of a cell as a tuple of cells.
+
+        Cells at least radius away from every edge simply add the shared
+        offset table to their coordinates. Cells in the border band need
+        clipping (or wrapping, on a torus), so their tuples are cached per
+        cell and per (moore, include_center, radius, passable_only) key; the
+        cache thus grows with the grid's perimeter, not its area.
+
+        """
+        x, y = int(pos[0]), int(pos[1])
+        if (radius <= x < self.width - radius and
+                radius <= y < self.height - radius):
+            offsets = _neighborhood_offsets(moore, include_center, radius)
+            if passable_only and self.terrain is not None:
+                terrain = self.terrain
+                return tuple((x + dx, y + dy) for dx, dy in offsets
+                             if not terrain[x + dx, y + dy])
+            return tuple((x + dx, y + dy) for dx, dy in offsets)
+
+        key = (moore, include_center, radius, passable_only)
+        try:
+            cache = self._neighborhood_cache[key]
+        except KeyError:
+            cache = self._neighborhood_cache[key] = {}
+        try:
+            return cache[x, y]
+        except KeyError:
+            pass
+
+        coordinates = []
+        seen = set()
+        for dx, dy in _neighborhood_offsets(moore, include_center, radius):
+            # Skip if not a torus and new coords out of bounds.
+            if not self.torus and (not (0 <= dx + x < self.width) or
+                                   not (0 <= dy + y < self.height)):
+                continue
+
+            px = self.torus_adj(x + dx, self.width)
+            py = self.torus_adj(y + dy, self.height)
+
+            # Skip if new coords out of bounds.
+            if(self.out_of_bounds((px, py))):
+                continue
+
+            coords = (px, py)
+            if coords not in seen:
+                seen.add(coords)
+                coordinates.append(coords)
+        if passable_only and self.terrain is not None:
+            coordinates = [coords for coords in coordinates
+                           if not self.terrain[coords]]
+        neighborhood = cache[x, y] = tuple(coordinates)
+        return neighborhood
 
     def get_neighborhood(self, pos, moore,
-                         include_center=False, radius=1):
+                         include_center=False, radius=1,
+                         passable_only=False):
         """ Return a list of cells that are in the neighborhood of a
         certain point.
 
@@ -188,6 +569,7 @@ class Grid:
             include_center: If True, return the (x, y) cell as well.
                             Otherwise, return surrounding cells only.
             radius: radius, in cells, of neighborhood to get.
+            passable_only: If True, skip cells whose terrain is blocked.
 
         Returns:
             A list of coordinate tuples representing the neighborhood;
@@ -195,7 +577,61 @@ class Grid:
             if not including the center).
 
         """
-        return list(self.iter_neighborhood(pos, moore, include_center, radius))
+        return list(self._neighborhood(pos, moore, include_center, radius,
+                                       passable_only))
+
+    def get_neighborhoods(self, positions, moore,
+                          include_center=False, radius=1,
+                          passable_only=False):
+        """ Return the neighborhoods of many cells in one vectorized call.
+
+        Args:
+            positions: Array-like of shape (N, 2) with the (x, y) cells to get
+                       the neighborhoods of.
+            moore: If True, return Moore neighborhoods
+                   (including diagonals)
+                   If False, return Von Neumann neighborhoods
+                   (exclude diagonals)
+            include_center: If True, include each (x, y) cell as well.
+                            Otherwise, return surrounding cells only.
+            radius: radius, in cells, of the neighborhoods to get.
+            passable_only: If True, mark cells whose terrain is blocked as
+                           invalid.
+
+        Returns:
+            A (cells, valid) tuple. cells is an int array of shape (N, K, 2),
+            where K is the size of a full neighborhood, and valid is a bool
+            array of shape (N, K) marking the entries that are cells of the
+            grid. The other entries (off the grid, blocked if passable_only,
+            or repeated cells on a torus smaller than the neighborhood) are
+            padded with -1. For each
+            position, the valid cells come in the same order as
+            get_neighborhood returns them.
+
+        """
+        positions = np.asarray(positions, dtype=int).reshape(-1, 2)
+        offsets = np.array(_neighborhood_offsets(moore, include_center,
+                                                 radius), dtype=int)
+        cells = positions[:, None, :] + offsets.reshape(1, -1, 2)
+        x, y = cells[..., 0], cells[..., 1]
+        if self.torus:
+            x %= self.width
+            y %= self.height
+            valid = np.ones(cells.shape[:2], dtype=bool)
+            if 2 * radius + 1 > min(self.width, self.height):
+                # Wrapped cells can repeat; keep their first occurrence.
+                linear = x * self.height + y
+                order = np.argsort(linear, axis=1, kind="stable")
+                ordered = np.take_along_axis(linear, order, axis=1)
+                repeated = np.zeros_like(valid)
+                repeated[:, 1:] = ordered[:, 1:] == ordered[:, :-1]
+                np.put_along_axis(valid, order, ~repeated, axis=1)
+        else:
+            valid = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        if passable_only and self.terrain is not None:
+            valid[valid] = self.terrain[x[valid], y[valid]] == 0
+        cells[~valid] = -1
+        return cells, valid
 
     def iter_neighbors(self, pos, moore,
                        include_center=False, radius=1):
@@ -285,6 +721,84 @@ class Grid:
         """
         return list(self.iter_cell_list_contents(cell_list))
 
+    def add_listener(self, listener):
+        """ Register an object to be told about placements, moves and
+        removals; see GridListener.
+
+        Events are sent by the public methods (place_agent, place_agents,
+        move_agent, move_to_empty, position_agent, remove_agent and
+        remove_agents) once the grid and the agent's pos are up to date.
+        A grid without listeners pays a single truth test per call.
+
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """ Stop sending events to a registered listener. """
+        self._listeners.remove(listener)
+
+    def _notify(self, event, *args):
+        """ Call the given method of every listener. """
+        for listener in self._listeners:
+            getattr(listener, event)(*args)
+
+    def checkpoint(self):
+        """ Open a checkpoint that rollback can return the grid to.
+
+        From now on, the public placement methods journal what they change,
+        so rolling back costs time in proportion to the changes rather than
+        to the grid size. Checkpoints nest: each rollback or commit closes
+        the most recent one. Changes made through the underscored methods
+        are not journaled.
+
+        """
+        if self._journal is None:
+            self._journal = []
+        self._checkpoints.append(len(self._journal))
+
+    def rollback(self):
+        """ Undo every placement, move and removal since the last
+        checkpoint, newest first, and close it. Listeners are told about
+        each undone change. """
+        if not self._checkpoints:
+            raise Exception("ERROR: No checkpoint to roll back to")
+        start = self._checkpoints.pop()
+        journal = self._journal
+        while len(journal) > start:
+            operation, agent, pos = journal.pop()
+            current = agent.pos
+            if operation == "place":
+                self._remove_agent(current, agent)
+                agent.pos = None
+                if self._listeners:
+                    self._notify("on_remove", agent, current)
+            elif operation == "move":
+                self._remove_agent(current, agent)
+                self._place_agent(pos, agent)
+                agent.pos = pos
+                if self._listeners:
+                    self._notify("on_move", agent, current, pos)
+            else:
+                self._place_agent(pos, agent)
+                agent.pos = pos
+                if self._listeners:
+                    self._notify("on_place", agent, pos)
+        if not self._checkpoints:
+            self._journal = None
+
+    def commit(self):
+        """ Keep the changes since the last checkpoint, and close it.
+
+        Inside an enclosing checkpoint the changes stay journaled, so
+        rolling that one back still undoes them.
+
+        """
+        if not self._checkpoints:
+            raise Exception("ERROR: No checkpoint to commit")
+        self._checkpoints.pop()
+        if not self._checkpoints:
+            self._journal = None
+
     def move_agent(self, agent, pos):
         """
         Move an agent from its current position to a new position.
@@ -295,39 +809,293 @@ class Grid:
             pos: Tuple of new position to move the agent to.
 
         """
-        self._remove_agent(agent.pos, agent)
+        old_pos = agent.pos
+        self._remove_agent(old_pos, agent)
         self._place_agent(pos, agent)
         agent.pos = pos
+        if self._journal is not None:
+            self._journal.append(("move", agent, old_pos))
+        if self._listeners:
+            self._notify("on_move", agent, old_pos, pos)
 
     def place_agent(self, agent, pos):
         """ Position an agent on the grid, and set its pos variable. """
         self._place_agent(pos, agent)
         agent.pos = pos
+        if self._journal is not None:
+            self._journal.append(("place", agent, None))
+        if self._listeners:
+            self._notify("on_place", agent, pos)
+
+    def place_agents(self, agents, positions):
+        """ Position many agents on the grid, and set their pos variables.
+
+        Args:
+            agents: Sequence of agent objects.
+            positions: Sequence of (x, y) tuples, or an (N, 2) array, with
+                       one position per agent.
+
+        """
+        agents, positions = _bulk_arguments(agents, positions)
+        for agent, pos in zip(agents, positions):
+            self._place_agent(pos, agent)
+            agent.pos = pos
+            if self._journal is not None:
+                self._journal.append(("place", agent, None))
+            if self._listeners:
+                self._notify("on_place", agent, pos)
 
     def _place_agent(self, pos, agent):
         """ Place the agent at the correct location. """
         x, y = pos
         self.grid[x][y] = agent
-        if pos in self.empties:
-            self.empties.remove(pos)
+        self.occupancy[x, y] = 1
+        self.empties.discard((x, y))
+        if self._fenwicks:
+            self._tally(agent, x, y, 1)
 
     def remove_agent(self, agent):
         """ Remove the agent from the grid and set its pos variable to None. """
         pos = agent.pos
         self._remove_agent(pos, agent)
         agent.pos = None
+        if self._journal is not None:
+            self._journal.append(("remove", agent, pos))
+        if self._listeners:
+            self._notify("on_remove", agent, pos)
+
+    def remove_agents(self, agents):
+        """ Remove many agents from the grid and set their pos to None.
+
+        Args:
+            agents: Sequence of agent objects.
+
+        """
+        for agent in agents:
+            pos = agent.pos
+            self._remove_agent(pos, agent)
+            agent.pos = None
+            if self._journal is not None:
+                self._journal.append(("remove", agent, pos))
+            if self._listeners:
+                self._notify("on_remove", agent, pos)
 
     def _remove_agent(self, pos, agent):
         """ Remove the agent from the given location. """
         x, y = pos
         self.grid[x][y] = None
-        self.empties.append(pos)
+        self.occupancy[x, y] = 0
+        if self._fenwicks:
+            self._tally(agent, x, y, -1)
+        if self.terrain is None or not self.terrain[x, y]:
+            self.empties.add((x, y))
 
     def is_cell_empty(self, pos):
         """ Returns a bool of the contents of a cell. """
         x, y = pos
         return True if self.grid[x][y] == self.default_val() else False
 
+    @accept_tuple_argument
+    def set_terrain(self, cell_list, value=1):
+        """ Set the static terrain type of cells.
+
+        Terrain replaces static agents such as walls: it costs one byte per
+        cell, nothing per step, and never shows up in cell contents. Blocked
+        cells are taken out of the empties index, so find_empty and
+        move_to_empty skip them, and neighborhood queries can exclude them
+        with passable_only.
+
+        Args:
+            cell_list: Array-like of (x, y) tuples, or single tuple.
+            value: Terrain type; 0 is open ground, and any other value
+                   (e.g. 1 for walls) blocks movement.
+
+        """
+        if self.terrain is None:
+            self.terrain = np.zeros((self.width, self.height), dtype=np.uint8)
+        for x, y in cell_list:
+            self.terrain[x, y] = value
+            if value:
+                self.empties.discard((x, y))
+            elif self.is_cell_empty((x, y)):
+                self.empties.add((x, y))
+        # Neighborhoods that skip blocked cells are now out of date.
+        for key in [key for key in self._neighborhood_cache if key[3]]:
+            del self._neighborhood_cache[key]
+
+    def is_passable(self, pos):
+        """ Returns whether a cell's terrain is open ground. """
+        x, y = pos
+        return self.terrain is None or not self.terrain[x, y]
+
+    def passable_mask(self):
+        """ Returns a bool NumPy array, indexed [x, y], of the open cells. """
+        if self.terrain is None:
+            return np.ones((self.width, self.height), dtype=bool)
+        return self.terrain == 0
+
+    def _count_layer(self, agent_type):
+        """ Return the per-cell counts to use for the given agent type. """
+        if agent_type is not None:
+            raise Exception("ERROR: Only MultiGrid counts agents by type")
+        return self.occupancy
+
+    def _fenwick(self, agent_type):
+        """ Return the Fenwick tree of the counts for an agent type, building
+        it on first use. """
+        try:
+            return self._fenwicks[agent_type]
+        except KeyError:
+            tree = _Fenwick2D(self._count_layer(agent_type))
+            self._fenwicks[agent_type] = tree
+            return tree
+
+    def _tally(self, agent, x, y, delta):
+        """ Add delta at (x, y) to the Fenwick trees counting agent. """
+        for agent_type, tree in self._fenwicks.items():
+            if agent_type is None or isinstance(agent, agent_type):
+                tree.add(x, y, delta)
+
+    def _wrapped_ranges(self, low, high, size):
+        """ Split an inclusive coordinate range into in-bounds ranges. """
+        if not self.torus:
+            return [(max(low, 0), min(high, size - 1))]
+        if high - low + 1 >= size:
+            return [(0, size - 1)]
+        low, high = low % size, high % size
+        if low <= high:
+            return [(low, high)]
+        return [(low, size - 1), (0, high)]
+
+    def count_agents(self, x_min, y_min, x_max, y_max, agent_type=None):
+        """ Count the agents in a rectangle of cells.
+
+        Uses a 2-D Fenwick tree, built on the first query and then updated
+        on every placement and removal, so queries and moves both cost
+        O(log W * log H) whatever the size of the rectangle.
+
+        Args:
+            x_min, y_min, x_max, y_max: Inclusive bounds of the rectangle.
+                Off-grid parts are ignored, or wrap around on a torus.
+            agent_type: On a MultiGrid, a key of a registered layer to count
+                        only agents of that type.
+
+        Returns:
+            The number of agents in the rectangle.
+
+        """
+        tree = self._fenwick(agent_type)
+        total = 0
+        for x0, x1 in self._wrapped_ranges(x_min, x_max, self.width):
+            for y0, y1 in self._wrapped_ranges(y_min, y_max, self.height):
+                if x0 <= x1 and y0 <= y1:
+                    total += tree.count(x0, y0, x1, y1)
+        return total
+
+    def count_agents_in(self, cell_list, agent_type=None):
+        """ Count the agents in a list of cells, e.g. a neighborhood.
+
+        Args:
+            cell_list: Array-like of (x, y) tuples.
+            agent_type: On a MultiGrid, a key of a registered layer to count
+                        only agents of that type.
+
+        Returns:
+            The number of agents in the cells.
+
+        """
+        cells = np.asarray(cell_list, dtype=int).reshape(-1, 2)
+        counts = self._count_layer(agent_type)
+        return int(counts[cells[:, 0], cells[:, 1]].sum())
+
+    def nearest(self, pos, agent_type=None, predicate=None,
+                metric="manhattan", k=1):
+        """ Find the agents nearest to a cell.
+
+        Searches outward in square rings around pos and stops as soon as no
+        unvisited cell can hold a closer match, so the cost depends on how
+        far away the matches are rather than on how many agents there are.
+        On a MultiGrid, registering a layer for agent_type lets each ring
+        skip the cells without such agents in one array lookup.
+
+        Args:
+            pos: (x, y) cell to search from.
+            agent_type: Class, or tuple of classes, the agents must be
+                        instances of. None to accept any agent.
+            predicate: Optional function of an agent returning whether it
+                       should be accepted, e.g. to select an enemy team.
+            metric: "manhattan", "chebyshev" or "euclidean".
+            k: Number of agents to return.
+
+        Returns:
+            A list of up to k agents, nearest first. Ties are broken by the
+            order in which the cells are scanned.
+
+        """
+        if metric not in _GRID_METRICS:
+            raise Exception("ERROR: Unknown metric " + repr(metric))
+        distance = _GRID_METRICS[metric]
+        x, y = pos
+        if self.torus:
+            max_radius = max(self.width, self.height) // 2
+        else:
+            max_radius = max(x, self.width - 1 - x, y, self.height - 1 - y)
+        found = []
+        for radius in range(max_radius + 1):
+            xs, ys = self._ring(x, y, radius)
+            occupied = self._occupied(xs, ys, agent_type)
+            for cx, cy in zip(xs[occupied].tolist(), ys[occupied].tolist()):
+                dx, dy = abs(cx - x), abs(cy - y)
+                if self.torus:
+                    dx, dy = min(dx, self.width - dx), min(dy, self.height - dy)
+                agent_distance = distance(dx, dy)
+                for agent in self.iter_cell_list_contents((cx, cy)):
+                    if agent_type is not None and \
+                            not isinstance(agent, agent_type):
+                        continue
+                    if predicate is not None and not predicate(agent):
+                        continue
+                    found.append((agent_distance, len(found), agent))
+            # Cells beyond this ring are at least radius + 1 away.
+            if len(found) >= k:
+                found.sort()
+                if found[k - 1][0] < radius + 1:
+                    break
+        found.sort()
+        return [agent for _, _, agent in found[:k]]
+
+    def _ring(self, x, y, radius):
+        """ Return the x and y arrays of the in-grid cells at a Chebyshev
+        distance of exactly radius from (x, y). """
+        if radius == 0:
+            return np.array([x]), np.array([y])
+        span = np.arange(-radius, radius + 1)
+        inner = span[1:-1]
+        dx = np.concatenate([span, span, np.full(len(inner), -radius),
+                             np.full(len(inner), radius)])
+        dy = np.concatenate([np.full(len(span), -radius),
+                             np.full(len(span), radius), inner, inner])
+        xs, ys = dx + x, dy + y
+        if not self.torus:
+            inside = ((xs >= 0) & (xs < self.width) &
+                      (ys >= 0) & (ys < self.height))
+            return xs[inside], ys[inside]
+        xs, ys = xs % self.width, ys % self.height
+        # Keep the cells which are still radius away once wrapped, once each.
+        dx, dy = np.abs(xs - x), np.abs(ys - y)
+        dx = np.minimum(dx, self.width - dx)
+        dy = np.minimum(dy, self.height - dy)
+        keep = np.nonzero(np.maximum(dx, dy) == radius)[0]
+        _, first = np.unique(xs[keep] * self.height + ys[keep],
+                             return_index=True)
+        keep = keep[np.sort(first)]
+        return xs[keep], ys[keep]
+
+    def _occupied(self, xs, ys, agent_type):
+        """ Return a bool array of which of the cells may hold agents of
+        agent_type. """
+        return self.occupancy[xs, ys] > 0
+
     def move_to_empty(self, agent):
         """ Moves agent to a random empty cell, vacating agent's old cell. """
         pos = agent.pos
@@ -338,11 +1106,15 @@ class Grid:
             self._place_agent(new_pos, agent)
             agent.pos = new_pos
             self._remove_agent(pos, agent)
+            if self._journal is not None:
+                self._journal.append(("move", agent, pos))
+            if self._listeners:
+                self._notify("on_move", agent, pos, new_pos)
 
     def find_empty(self):
         """ Pick a random empty cell. """
         if self.exists_empty_cells():
-            pos = random.choice(self.empties)
+            pos = self.empties.choice()
             return pos
         else:
             return None
@@ -354,7 +1126,6 @@ class Grid:
 
 class SingleGrid(Grid):
     """ Grid where each cell contains exactly at most one object. """
-    empties = []
 
     def __init__(self, width, height, torus):
         """ Create a new single-item grid.
@@ -384,6 +1155,10 @@ class SingleGrid(Grid):
             coords = (x, y)
         agent.pos = coords
         self._place_agent(coords, agent)
+        if self._journal is not None:
+            self._journal.append(("place", agent, None))
+        if self._listeners:
+            self._notify("on_place", agent, coords)
 
     def _place_agent(self, pos, agent):
         if self.is_cell_empty(pos):
@@ -392,6 +1167,109 @@ class SingleGrid(Grid):
             raise Exception("Cell not empty")
 
 
+class CompactSingleGrid(SingleGrid):
+    """ SingleGrid stored in NumPy arrays instead of a list-of-lists.
+
+    Each cell holds the id of its agent in an int32 array, or -1 if it is
+    empty, and ids index a table of agents. Placement, removal and emptiness
+    checks are array operations, the empties index is array-based too, and
+    agent_ids can be exported (e.g. as an occupancy image) without copying.
+    A 2000x2000 grid stores its cells in 16 MB instead of a list slot each.
+
+    Properties:
+        agent_ids: NumPy int32 array, indexed [x, y], with the id of the
+                   agent in each cell or -1. Treat it as read-only.
+
+    """
+    def _build_cells(self):
+        """ Create the id array, the agent table and the empties index. """
+        self.agent_ids = np.full((self.width, self.height), -1,
+                                 dtype=np.int32)
+        self._agents = []
+        self._free_ids = []
+        self.empties = _ArrayEmptyCells(self.width, self.height)
+
+    @property
+    def occupancy(self):
+        """ Number of agents in each cell, as a new NumPy array. """
+        return (self.agent_ids >= 0).astype(np.int32)
+
+    def __getitem__(self, index):
+        return [self._agents[agent_id] if agent_id >= 0 else None
+                for agent_id in self.agent_ids[index].tolist()]
+
+    def __iter__(self):
+        agents = self._agents
+        for x in range(self.width):
+            for agent_id in self.agent_ids[x].tolist():
+                yield agents[agent_id] if agent_id >= 0 else None
+
+    def coord_iter(self):
+        """ An iterator that returns coordinates as well as cell contents. """
+        agents = self._agents
+        for x in range(self.width):
+            for y, agent_id in enumerate(self.agent_ids[x].tolist()):
+                yield (agents[agent_id] if agent_id >= 0 else None), x, y
+
+    @accept_tuple_argument
+    def iter_cell_list_contents(self, cell_list):
+        """
+        Args:
+            cell_list: Array-like of (x, y) tuples, or single tuple.
+
+        Returns:
+            An iterator of the contents of the cells identified in cell_list
+
+        """
+        agent_ids = self.agent_ids
+        return (self._agents[agent_ids[x, y]] for x, y in cell_list
+                if agent_ids[x, y] >= 0)
+
+    def _place_agent(self, pos, agent):
+        """ Place the agent at the correct location. """
+        x, y = pos
+        if self.agent_ids[x, y] >= 0:
+            raise Exception("Cell not empty")
+        if self._free_ids:
+            agent_id = self._free_ids.pop()
+            self._agents[agent_id] = agent
+        else:
+            agent_id = len(self._agents)
+            self._agents.append(agent)
+        self.agent_ids[x, y] = agent_id
+        self.empties.discard((x, y))
+        if self._fenwicks:
+            self._tally(agent, x, y, 1)
+
+    def _remove_agent(self, pos, agent):
+        """ Remove the agent from the given location. """
+        x, y = pos
+        agent_id = int(self.agent_ids[x, y])
+        self.agent_ids[x, y] = -1
+        self._agents[agent_id] = None
+        self._free_ids.append(agent_id)
+        if self._fenwicks:
+            self._tally(agent, x, y, -1)
+        if self.terrain is None or not self.terrain[x, y]:
+            self.empties.add((x, y))
+
+    def is_cell_empty(self, pos):
+        """ Returns a bool of the contents of a cell. """
+        x, y = pos
+        return self.agent_ids[x, y] < 0
+
+    def count_agents_in(self, cell_list, agent_type=None):
+        """ Count the agents in a list of cells, e.g. a neighborhood. """
+        if agent_type is not None:
+            return super().count_agents_in(cell_list, agent_type)
+        cells = np.asarray(cell_list, dtype=int).reshape(-1, 2)
+        return int((self.agent_ids[cells[:, 0], cells[:, 1]] >= 0).sum())
+
+    def _occupied(self, xs, ys, agent_type):
+        """ Return a bool array of which of the cells hold an agent. """
+        return self.agent_ids[xs, ys] >= 0
+
+
 class MultiGrid(Grid):
     """ Grid where each cell can contain more than one object.
 
@@ -408,27 +1286,215 @@ class MultiGrid(Grid):
 
         grid: Internal list-of-lists which holds the grid cells themselves.
 
+        layers: Dictionary mapping each registered agent type (a class or a
+                tuple of classes) to a NumPy array, indexed [x, y], counting
+                the agents of that type in each cell.
+
     Methods:
         get_neighbors: Returns the objects surrounding a given cell.
+        register_layer: Starts maintaining an occupancy layer for a type.
+        layer_values: Returns the layer counts for a list of cells.
+        count_agents: Counts the agents, or those of a registered layer, in a
+        rectangle of cells.
     """
+    def __init__(self, width, height, torus, layer_types=()):
+        """ Create a new multi-item grid.
+
+        Args:
+            width, height: The width and height of the grid
+            torus: Boolean whether the grid wraps or not.
+            layer_types: Agent types to keep an occupancy layer for; see
+                         register_layer.
+
+        """
+        super().__init__(width, height, torus)
+        self.layers = {}
+        self._type_layers = {}
+        for agent_type in layer_types:
+            self.register_layer(agent_type)
+
     @staticmethod
     def default_val():
         """ Default value for new cell elements. """
         return set()
 
+    def register_layer(self, agent_type):
+        """ Keep a per-cell count of the agents of a given type.
+
+        The layer is updated on every placement and removal, so questions
+        like "which of these cells hold a wall or a player" become a single
+        array lookup instead of a scan over the cell contents.
+
+        Args:
+            agent_type: A class, or a tuple of classes, as accepted by
+                        isinstance. Agents are counted if they are instances
+                        of it.
+
+        Returns:
+            The layer, a NumPy int32 array indexed [x, y].
+
+        """
+        if agent_type in self.layers:
+            return self.layers[agent_type]
+        layer = np.zeros((self.width, self.height), dtype=np.int32)
+        for (x, y), cell in self._iter_occupied():
+            layer[x, y] = sum(1 for agent in cell
+                              if isinstance(agent, agent_type))
+        self.layers[agent_type] = layer
+        self._type_layers = {}
+        return layer
+
+    def layer_values(self, agent_type, cell_list):
+        """ Look up a registered layer for several cells at once.
+
+        Args:
+            agent_type: Key the layer was registered with.
+            cell_list: Array-like of (x, y) tuples.
+
+        Returns:
+            A NumPy array with the number of agents of that type in each cell.
+
+        """
+        cells = np.asarray(cell_list, dtype=int).reshape(-1, 2)
+        return self.layers[agent_type][cells[:, 0], cells[:, 1]]
+
+    def _count_layer(self, agent_type):
+        """ Return the per-cell counts to use for the given agent type. """
+        if agent_type is None:
+            return self.occupancy
+        return self.layers[agent_type]
+
+    def _occupied(self, xs, ys, agent_type):
+        """ Return a bool array of which of the cells may hold agents of
+        agent_type, using its layer if one is registered. """
+        counts = self.layers.get(agent_type, self.occupancy)
+        return counts[xs, ys] > 0
+
+    def _iter_occupied(self):
+        """ Iterate over ((x, y), cell) for the cells holding agents. """
+        for x, y in zip(*np.nonzero(self.occupancy)):
+            yield (x, y), self.grid[x][y]
+
+    def _layers_for(self, agent):
+        """ Return the layers an agent is counted in, cached per class. """
+        agent_class = type(agent)
+        try:
+            return self._type_layers[agent_class]
+        except KeyError:
+            layers = [layer for agent_type, layer in self.layers.items()
+                      if issubclass(agent_class, agent_type)]
+            self._type_layers[agent_class] = layers
+            return layers
+
     def _place_agent(self, pos, agent):
         """ Place the agent at the correct location. """
         x, y = pos
-        self.grid[x][y].add(agent)
-        if pos in self.empties:
-            self.empties.remove(pos)
+        cell = self.grid[x][y]
+        if agent in cell:
+            return
+        cell.add(agent)
+        self.occupancy[x, y] += 1
+        if self._fenwicks:
+            self._tally(agent, x, y, 1)
+        if len(cell) == 1:
+            self.empties.discard((x, y))
+        if self.layers:
+            for layer in self._layers_for(agent):
+                layer[x, y] += 1
 
     def _remove_agent(self, pos, agent):
         """ Remove the agent from the given location. """
         x, y = pos
-        self.grid[x][y].remove(agent)
-        if self.is_cell_empty(pos):
-            self.empties.append(pos)
+        cell = self.grid[x][y]
+        cell.remove(agent)
+        self.occupancy[x, y] -= 1
+        if self._fenwicks:
+            self._tally(agent, x, y, -1)
+        if not cell and (self.terrain is None or not self.terrain[x, y]):
+            self.empties.add((x, y))
+        if self.layers:
+            for layer in self._layers_for(agent):
+                layer[x, y] -= 1
+
+    def is_cell_empty(self, pos):
+        """ Returns a bool of the contents of a cell. """
+        x, y = pos
+        return not self.occupancy[x, y]
+
+    def place_agents(self, agents, positions):
+        """ Position many agents on the grid, and set their pos variables.
+
+        Cell sets are filled in one pass, then the occupancy, the layers and
+        the empties index are updated once for the whole batch.
+
+        Args:
+            agents: Sequence of agent objects.
+            positions: Sequence of (x, y) tuples, or an (N, 2) array, with
+                       one position per agent.
+
+        """
+        agents, positions = _bulk_arguments(agents, positions)
+        placed = []
+        cells = []
+        for agent, pos in zip(agents, positions):
+            x, y = pos
+            cell = self.grid[x][y]
+            if agent not in cell:
+                cell.add(agent)
+                placed.append(agent)
+                cells.append(pos)
+            agent.pos = pos
+        self._update_counts(placed, cells, 1)
+        for pos in set(cells):
+            self.empties.discard(pos)
+        if self._journal is not None:
+            self._journal.extend(("place", agent, None) for agent in placed)
+        if self._listeners:
+            for agent, pos in zip(placed, cells):
+                self._notify("on_place", agent, pos)
+
+    def remove_agents(self, agents):
+        """ Remove many agents from the grid and set their pos to None.
+
+        Args:
+            agents: Sequence of agent objects.
+
+        """
+        agents = list(agents)
+        cells = []
+        for agent in agents:
+            x, y = agent.pos
+            self.grid[x][y].remove(agent)
+            cells.append((x, y))
+            agent.pos = None
+        self._update_counts(agents, cells, -1)
+        for x, y in set(cells):
+            if not self.grid[x][y] and (self.terrain is None or
+                                        not self.terrain[x, y]):
+                self.empties.add((x, y))
+        if self._journal is not None:
+            self._journal.extend(("remove", agent, pos)
+                                 for agent, pos in zip(agents, cells))
+        if self._listeners:
+            for agent, pos in zip(agents, cells):
+                self._notify("on_remove", agent, pos)
+
+    def _update_counts(self, agents, cells, delta):
+        """ Add delta to the occupancy and layer counts of many agents. """
+        if not cells:
+            return
+        xs, ys = np.array(cells, dtype=int).T
+        np.add.at(self.occupancy, (xs, ys), delta)
+        if self._fenwicks:
+            for agent, (x, y) in zip(agents, cells):
+                self._tally(agent, x, y, delta)
+        if self.layers:
+            indices = {}
+            for i, agent in enumerate(agents):
+                for layer in self._layers_for(agent):
+                    indices.setdefault(id(layer), (layer, []))[1].append(i)
+            for layer, index in indices.values():
+                np.add.at(layer, (xs[index], ys[index]), delta)
 
     @accept_tuple_argument
     def iter_cell_list_contents(self, cell_list):
@@ -444,16 +1510,170 @@ class MultiGrid(Grid):
             self[x][y] for x, y in cell_list if not self.is_cell_empty((x, y)))
 
 
+_EMPTY_CELL = frozenset()
+
+
+class SparseMultiGrid(MultiGrid):
+    """ MultiGrid which only stores the cells holding agents.
+
+    Cells live in a dict keyed by (x, y), created when an agent arrives and
+    dropped when the last one leaves, so memory and startup scale with the
+    number of agents instead of the map area. The API is the same as
+    MultiGrid's; empty cells read as an empty frozenset. Registered layers
+    and the occupancy property are still dense arrays, so only use them
+    when the map fits in memory.
+
+    """
+    def _build_cells(self):
+        """ Create the cell dict and the empties index. """
+        self._cells = {}
+        self.empties = _SparseEmptyCells(self)
+        # Blocked cells, and stored cells among them, for len(empties).
+        self._blocked_cells = 0
+        self._blocked_stored = 0
+
+    @accept_tuple_argument
+    def set_terrain(self, cell_list, value=1):
+        """ Set the static terrain type of cells; see Grid.set_terrain. """
+        cells = {(int(x), int(y)) for x, y in cell_list}
+        blocked = bool(value)
+        for x, y in cells:
+            if self.terrain is not None and bool(self.terrain[x, y]) == blocked:
+                continue
+            change = 1 if blocked else -1
+            self._blocked_cells += change
+            if (x, y) in self._cells:
+                self._blocked_stored += change
+        super().set_terrain(list(cells), value)
+
+    @property
+    def occupancy(self):
+        """ Number of agents in each cell, as a new dense NumPy array. """
+        occupancy = np.zeros((self.width, self.height), dtype=np.int32)
+        for (x, y), cell in self._cells.items():
+            occupancy[x, y] = len(cell)
+        return occupancy
+
+    def __getitem__(self, index):
+        cells = self._cells
+        return [cells.get((index, y), _EMPTY_CELL) for y in range(self.height)]
+
+    def __iter__(self):
+        return (cell for cell, x, y in self.coord_iter())
+
+    def coord_iter(self):
+        """ An iterator that returns coordinates as well as cell contents. """
+        cells = self._cells
+        for x in range(self.width):
+            for y in range(self.height):
+                yield cells.get((x, y), _EMPTY_CELL), x, y
+
+    def _iter_occupied(self):
+        """ Iterate over ((x, y), cell) for the cells holding agents. """
+        return iter(self._cells.items())
+
+    # Without an occupancy array, bulk operations just place one at a time.
+    place_agents = Grid.place_agents
+    remove_agents = Grid.remove_agents
+
+    def count_agents(self, x_min, y_min, x_max, y_max, agent_type=None):
+        """ Count the agents in a rectangle of cells.
+
+        Registered layers are dense and use a Fenwick tree, like
+        MultiGrid; plain counts scan the occupied cells instead of
+        building a table the size of the map.
+
+        """
+        if agent_type is not None:
+            return super().count_agents(x_min, y_min, x_max, y_max,
+                                        agent_type)
+        x_ranges = self._wrapped_ranges(x_min, x_max, self.width)
+        y_ranges = self._wrapped_ranges(y_min, y_max, self.height)
+        return sum(len(cell) for (x, y), cell in self._cells.items()
+                   if any(x0 <= x <= x1 for x0, x1 in x_ranges) and
+                   any(y0 <= y <= y1 for y0, y1 in y_ranges))
+
+    def count_agents_in(self, cell_list, agent_type=None):
+        """ Count the agents in a list of cells, e.g. a neighborhood. """
+        if agent_type is not None:
+            return super().count_agents_in(cell_list, agent_type)
+        cells = self._cells
+        return sum(len(cells[x, y]) for x, y in cell_list
+                   if (x, y) in cells)
+
+    def _occupied(self, xs, ys, agent_type):
+        """ Return a bool array of which of the cells may hold agents of
+        agent_type, using its layer if one is registered. """
+        if agent_type in self.layers:
+            return self.layers[agent_type][xs, ys] > 0
+        cells = self._cells
+        return np.array([(x, y) in cells
+                         for x, y in zip(xs.tolist(), ys.tolist())],
+                        dtype=bool)
+
+    @accept_tuple_argument
+    def iter_cell_list_contents(self, cell_list):
+        """
+        Args:
+            cell_list: Array-like of (x, y) tuples, or single tuple.
+
+        Returns:
+            A iterator of the contents of the cells identified in cell_list
+
+        """
+        cells = self._cells
+        return itertools.chain.from_iterable(
+            cells[x, y] for x, y in cell_list if (x, y) in cells)
+
+    def _place_agent(self, pos, agent):
+        """ Place the agent at the correct location. """
+        x, y = pos
+        cell = self._cells.get((x, y))
+        if cell is None:
+            cell = self._cells[x, y] = set()
+            if self._blocked_cells and self.terrain[x, y]:
+                self._blocked_stored += 1
+        elif agent in cell:
+            return
+        cell.add(agent)
+        if self._fenwicks:
+            self._tally(agent, x, y, 1)
+        if self.layers:
+            for layer in self._layers_for(agent):
+                layer[x, y] += 1
+
+    def _remove_agent(self, pos, agent):
+        """ Remove the agent from the given location. """
+        x, y = pos
+        cell = self._cells[x, y]
+        cell.remove(agent)
+        if not cell:
+            del self._cells[x, y]
+            if self._blocked_cells and self.terrain[x, y]:
+                self._blocked_stored -= 1
+        if self._fenwicks:
+            self._tally(agent, x, y, -1)
+        if self.layers:
+            for layer in self._layers_for(agent):
+                layer[x, y] -= 1
+
+    def is_cell_empty(self, pos):
+        """ Returns a bool of the contents of a cell. """
+        x, y = pos
+        return (x, y) not in self._cells
+
+
 class ContinuousSpace:
     """ Continuous space where each agent can have an arbitrary position.
 
     Assumes that all agents are point objects, and have a pos property storing
-    their position as an (x, y) tuple. This class uses a MultiGrid internally
-    to store agent objects, to speed up neighborhood lookups.
+    their position as an (x, y) tuple. Agent positions are also kept in a
+    contiguous NumPy array, indexed by a uniform grid hash, to speed up
+    neighborhood lookups. Moving an agent overwrites its row; agents that
+    leave their hash cell are set aside as stale and checked directly by
+    queries, and the hash is rebuilt lazily once too many of them pile up.
 
     """
-    _grid = None
-
     def __init__(self, x_max, y_max, torus, x_min=0, y_min=0,
                  grid_width=100, grid_height=100):
         """ Create a new continuous space.
@@ -464,11 +1684,12 @@ class ContinuousSpace:
             x_min, y_min: (default 0) If provided, set the minimum x and y
                           coordinates for the space. Below them, values loop to
                           the other edge (if torus=True) or raise an exception.
-            grid_width, _height: (default 100) Determine the size of the
-                                 internal storage grid. More cells will slow
-                                 down movement, but speed up neighbor lookup.
-                                 Probably only fiddle with this if one or the
-                                 other is impacting your model's performance.
+            grid_width, _height: (default 100) Determine the number of cells
+                                 of the internal hash. More cells mean fewer
+                                 candidates per query, but more empty cells to
+                                 skip. Probably only fiddle with this if one or
+                                 the other is impacting your model's
+                                 performance.
 
         """
         self.x_min = x_min
@@ -481,10 +1702,22 @@ class ContinuousSpace:
         self.size = np.array((self.width, self.height))
         self.torus = torus
 
+        self.grid_width = grid_width
+        self.grid_height = grid_height
         self.cell_width = (self.x_max - self.x_min) / grid_width
         self.cell_height = (self.y_max - self.y_min) / grid_height
 
-        self._grid = MultiGrid(grid_width, grid_height, torus)
+        self._agent_points = np.zeros((16, 2))
+        self._index_to_agent = []
+        self._agent_to_index = {}
+        # Hash: agent indices sorted by cell, where each cell starts, and the
+        # cell each index was hashed in. A None order means a full rebuild.
+        self._hash_order = None
+        self._hash_starts = None
+        self._hash_cells = None
+        # Indices whose hash entry is wrong, and the same as a mask.
+        self._stale = set()
+        self._stale_mask = np.zeros(16, dtype=bool)
 
     def place_agent(self, agent, pos):
         """ Place a new agent in the space.
@@ -507,19 +1740,230 @@ class ContinuousSpace:
 
         """
         pos = self.torus_adj(pos)
-        self._remove_agent(agent.pos, agent)
-        self._place_agent(pos, agent)
+        self._update_point(self._agent_to_index[agent], pos)
         agent.pos = pos
 
+    def remove_agent(self, agent):
+        """ Remove an agent from the space and set its pos variable to None.
+
+        Args:
+            agent: The agent object to remove.
+
+        """
+        self._remove_agent(agent.pos, agent)
+        agent.pos = None
+
     def _place_agent(self, pos, agent):
-        """ Place an agent at a given point, and update the internal grid. """
-        cell = self._point_to_cell(pos)
-        self._grid._place_agent(cell, agent)
+        """ Store an agent's position. """
+        index = self._agent_to_index.get(agent)
+        if index is None:
+            index = len(self._index_to_agent)
+            if index == len(self._agent_points):
+                grown = np.zeros((2 * index, 2))
+                grown[:index] = self._agent_points
+                self._agent_points = grown
+                self._stale_mask = np.concatenate(
+                    (self._stale_mask, np.zeros(index, dtype=bool)))
+            self._agent_to_index[agent] = index
+            self._index_to_agent.append(agent)
+            self._agent_points[index] = pos
+            if self._hash_order is not None:
+                self._mark_stale(index)
+        else:
+            self._update_point(index, pos)
 
     def _remove_agent(self, pos, agent):
-        """ Remove an agent at a given point, and update the internal grid. """
-        cell = self._point_to_cell(pos)
-        self._grid._remove_agent(cell, agent)
+        """ Drop an agent's position. """
+        index = self._agent_to_index.pop(agent)
+        last = self._index_to_agent.pop()
+        last_index = len(self._index_to_agent)
+        if last is not agent:
+            # Fill the hole with the last agent, to keep the array contiguous.
+            self._index_to_agent[index] = last
+            self._agent_to_index[last] = index
+            self._agent_points[index] = self._agent_points[last_index]
+        if self._hash_order is not None:
+            # The hash entry at index belonged to the removed agent, and
+            # entries at last_index are now past the end and get filtered out.
+            self._stale_mask[last_index] = False
+            self._stale.discard(last_index)
+            if last is not agent:
+                self._mark_stale(index)
+
+    def _update_point(self, index, pos):
+        """ Overwrite an agent's position, marking it stale if it left the
+        hash cell it is filed under.
+
+        """
+        self._agent_points[index] = pos
+        if self._hash_order is None or self._stale_mask[index]:
+            return
+        x, y = pos
+        cell_x = math.floor((x - self.x_min) / self.cell_width)
+        cell_y = math.floor((y - self.y_min) / self.cell_height)
+        cell_x = min(max(cell_x, 0), self.grid_width - 1)
+        cell_y = min(max(cell_y, 0), self.grid_height - 1)
+        if cell_x * self.grid_height + cell_y != self._hash_cells[index]:
+            self._mark_stale(index)
+
+    def _mark_stale(self, index):
+        """ Set an index aside, and drop the hash if too many are stale. """
+        self._stale_mask[index] = True
+        self._stale.add(index)
+        if len(self._stale) > max(64, len(self._index_to_agent) // 8):
+            self._hash_order = None
+
+    def _build_hash(self):
+        """ Sort the agents by hash cell, and find where each cell starts. """
+        n = len(self._index_to_agent)
+        cell_x, cell_y = self._points_to_cells(self._agent_points[:n])
+        cells = cell_x * self.grid_height + cell_y
+        self._hash_order = np.argsort(cells, kind="stable")
+        self._hash_starts = np.searchsorted(
+            cells[self._hash_order],
+            np.arange(self.grid_width * self.grid_height + 1))
+        self._hash_cells = cells
+        self._stale.clear()
+        self._stale_mask[:] = False
+
+    def _points_to_cells(self, points):
+        """ Get the hash cell coordinates of an (N, 2) array of points. """
+        cell_x = np.floor((points[:, 0] - self.x_min) / self.cell_width)
+        cell_y = np.floor((points[:, 1] - self.y_min) / self.cell_height)
+        return (np.clip(cell_x, 0, self.grid_width - 1).astype(int),
+                np.clip(cell_y, 0, self.grid_height - 1).astype(int))
+
+    def _window(self, cx0, cx1, cy0, cy1):
+        """ Get the indices of the agents in a window of hash cells, plus
+        all stale agents, which may be anywhere.
+
+        Args:
+            cx0, cx1, cy0, cy1: Inclusive cell ranges of the window. On a
+                                torus they wrap around, otherwise they are
+                                clipped to the hash.
+
+        """
+        if self._hash_order is None:
+            self._build_hash()
+        if self.torus:
+            if cx1 - cx0 + 1 >= self.grid_width:
+                columns = np.arange(self.grid_width)
+            else:
+                columns = np.arange(cx0, cx1 + 1) % self.grid_width
+            if cy1 - cy0 + 1 >= self.grid_height:
+                rows = [(0, self.grid_height - 1)]
+            else:
+                cy0 %= self.grid_height
+                cy1 %= self.grid_height
+                if cy0 <= cy1:
+                    rows = [(cy0, cy1)]
+                else:
+                    rows = [(cy0, self.grid_height - 1), (0, cy1)]
+        else:
+            columns = np.arange(max(cx0, 0), min(cx1, self.grid_width - 1) + 1)
+            cy0, cy1 = max(cy0, 0), min(cy1, self.grid_height - 1)
+            rows = [(cy0, cy1)] if cy0 <= cy1 else []
+
+        # Within a column, a range of rows is a contiguous range of cells.
+        first_cells = columns * self.grid_height
+        starts = [self._hash_starts[first_cells + lo] for lo, hi in rows]
+        ends = [self._hash_starts[first_cells + hi + 1] for lo, hi in rows]
+        if not starts:
+            indices = np.empty(0, dtype=int)
+        else:
+            indices = self._hash_order[_concat_ranges(np.concatenate(starts),
+                                                      np.concatenate(ends))]
+        if len(self._hash_cells) > len(self._index_to_agent):
+            indices = indices[indices < len(self._index_to_agent)]
+        if not self._stale:
+            return indices
+        indices = indices[~self._stale_mask[indices]]
+        stale = np.fromiter(self._stale, dtype=int, count=len(self._stale))
+        return np.concatenate((indices, stale))
+
+    def _windows(self, cx0, cx1, cy0, cy1):
+        """ Get the agents in many windows of hash cells at once, plus all
+        stale agents for each window, as _window does for one.
+
+        Args:
+            cx0, cx1, cy0, cy1: Integer arrays with the inclusive cell ranges
+                                of each window, wrapped or clipped as in
+                                _window.
+
+        Returns:
+            Two arrays, grouped by window and in _window's order within each:
+            the window of each candidate, and its agent index.
+
+        """
+        if self._hash_order is None:
+            self._build_hash()
+        gw, gh = self.grid_width, self.grid_height
+        count = len(cx0)
+        if self.torus:
+            columns = np.minimum(cx1 - cx0 + 1, gw)
+            first_columns = np.where(columns == gw, 0, cx0 % gw)
+            full = cy1 - cy0 + 1 >= gh
+            lo, hi = cy0 % gh, cy1 % gh
+            split = ~full & (lo > hi)
+            # Row range a0..a1, then 0..b1 when the rows wrap around.
+            a0 = np.where(full, 0, lo)
+            a1 = np.where(full | split, gh - 1, hi)
+            b1 = np.where(split, hi, -1)
+        else:
+            first_columns = np.maximum(cx0, 0)
+            columns = np.maximum(
+                np.minimum(cx1, gw - 1) - first_columns + 1, 0)
+            a0 = np.clip(cy0, 0, gh)
+            a1 = np.maximum(np.minimum(cy1, gh - 1), a0 - 1)
+            b1 = np.full(count, -1)
+
+        # One segment per window, row range and column.
+        windows = np.repeat(np.arange(count), columns)
+        column_cells = gh * ((np.repeat(first_columns, columns) +
+                              _concat_ranges(np.zeros_like(columns), columns))
+                             % gw)
+        segment_windows = np.concatenate((windows, windows))
+        starts = np.concatenate((column_cells + a0[windows], column_cells))
+        ends = np.concatenate((column_cells + a1[windows] + 1,
+                               column_cells + b1[windows] + 1))
+        order = np.argsort(segment_windows, kind="stable")
+        starts = self._hash_starts[starts[order]]
+        ends = self._hash_starts[ends[order]]
+        owners = np.repeat(segment_windows[order], ends - starts)
+        indices = self._hash_order[_concat_ranges(starts, ends)]
+
+        if len(self._hash_cells) > len(self._index_to_agent):
+            keep = indices < len(self._index_to_agent)
+            owners, indices = owners[keep], indices[keep]
+        if not self._stale:
+            return owners, indices
+        keep = ~self._stale_mask[indices]
+        owners, indices = owners[keep], indices[keep]
+        stale = np.fromiter(self._stale, dtype=int, count=len(self._stale))
+        owners = np.concatenate((owners, np.repeat(np.arange(count),
+                                                   len(stale))))
+        indices = np.concatenate((indices, np.tile(stale, count)))
+        order = np.argsort(owners, kind="stable")
+        return owners[order], indices[order]
+
+    def _candidates(self, pos, radius):
+        """ Get the indices of the agents in the hash cells a circle covers. """
+        x, y = pos
+        return self._window(
+            math.floor((x - radius - self.x_min) / self.cell_width),
+            math.floor((x + radius - self.x_min) / self.cell_width),
+            math.floor((y - radius - self.y_min) / self.cell_height),
+            math.floor((y + radius - self.y_min) / self.cell_height))
+
+    def _offsets(self, pos, points):
+        """ Get the vectors from pos to an (N, 2) array of points, taking the
+        shortest way around a toroidal space.
+
+        """
+        offsets = points - np.asarray(pos, dtype=float)
+        if self.torus:
+            offsets = (offsets + self.size / 2) % self.size - self.size / 2
+        return offsets
 
     def get_neighbors(self, pos, radius, include_center=True):
         """ Get all objects within a certain radius.
@@ -533,44 +1977,213 @@ class ContinuousSpace:
                             agent in the results.
 
         """
-        # Get candidate objects
-        scale = max(self.cell_width, self.cell_height)
-        cell_radius = math.ceil(radius / scale)
-        cell_pos = self._point_to_cell(pos)
-        possible_objs = self._grid.get_neighbors(cell_pos,
-                                                 True, True, cell_radius)
-        neighbors = []
-        # Iterate over candidates and check actual distance.
-        for obj in possible_objs:
-            dist = self.get_distance(pos, obj.pos)
-            if dist <= radius and (include_center or dist > 0):
-                neighbors.append(obj)
-        return neighbors
+        candidates = self._candidates(pos, radius)
+        offsets = self._offsets(pos, self._agent_points[candidates])
+        dists = np.sqrt(np.einsum("ij,ij->i", offsets, offsets))
+        within = dists <= radius
+        if not include_center:
+            within &= dists > 0
+        return [self._index_to_agent[i] for i in candidates[within]]
+
+    def get_neighbors_many(self, points, radius, include_center=True):
+        """ Get all objects within a certain radius of each of many points.
+
+        The candidates of all the points are gathered from the hash and
+        their distances computed in single array operations, rather than
+        one query per point.
+
+        Args:
+            points: Array-like of shape (N, 2) with the centers to search at.
+            radius: Get all the objects within this distance of each center.
+            include_center: As in get_neighbors.
+
+        Returns:
+            A list with the list of neighbors of each point.
+
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        xs = points[:, 0] - self.x_min
+        ys = points[:, 1] - self.y_min
+        owners, candidates = self._windows(
+            np.floor((xs - radius) / self.cell_width).astype(int),
+            np.floor((xs + radius) / self.cell_width).astype(int),
+            np.floor((ys - radius) / self.cell_height).astype(int),
+            np.floor((ys + radius) / self.cell_height).astype(int))
+        offsets = self._offsets(points[owners],
+                                self._agent_points[candidates])
+        dists = np.sqrt(np.einsum("ij,ij->i", offsets, offsets))
+        within = dists <= radius
+        if not include_center:
+            within &= dists > 0
+        agents = [self._index_to_agent[i] for i in candidates[within].tolist()]
+        bounds = np.cumsum(np.bincount(owners[within],
+                                       minlength=len(points))).tolist()
+        return [agents[start:end]
+                for start, end in zip([0] + bounds[:-1], bounds)]
+
+    def get_nearest(self, pos, k=1, include_center=True):
+        """ Get the k objects nearest to a point.
+
+        The search grows a window of hash cells around the point until the
+        k-th nearest candidate is provably closer than anything outside it,
+        so its cost follows the distance to the targets, not the population.
+
+        Args:
+            pos: (x,y) coordinate tuple to center the search at.
+            k: Number of objects to return.
+            include_center: If False, ignore objects at the exact coordinates.
+
+        Returns:
+            A list of at most k objects, nearest first.
+
+        """
+        x, y = pos
+        cell_x = math.floor((x - self.x_min) / self.cell_width)
+        cell_y = math.floor((y - self.y_min) / self.cell_height)
+        cell_x = min(max(cell_x, 0), self.grid_width - 1)
+        cell_y = min(max(cell_y, 0), self.grid_height - 1)
+        cell_size = min(self.cell_width, self.cell_height)
+        span = max(self.grid_width, self.grid_height)
+        r = 0
+        while True:
+            candidates = self._window(cell_x - r, cell_x + r,
+                                      cell_y - r, cell_y + r)
+            offsets = self._offsets(pos, self._agent_points[candidates])
+            dists = np.sqrt(np.einsum("ij,ij->i", offsets, offsets))
+            if not include_center:
+                candidates = candidates[dists > 0]
+                dists = dists[dists > 0]
+            if len(dists) >= k:
+                order = np.argsort(dists, kind="stable")[:k]
+                if dists[order[-1]] <= r * cell_size:
+                    break
+            if r >= span:
+                order = np.argsort(dists, kind="stable")[:k]
+                break
+            r = 2 * r if r else 1
+        return [self._index_to_agent[i] for i in candidates[order]]
+
+    def get_nearest_many(self, points, k=1, include_center=True):
+        """ Get the k objects nearest to each of many points.
+
+        Runs the window-growing search of get_nearest for all the points
+        together: each round queries the windows of the points still
+        searching in one batch.
+
+        Args:
+            points: Array-like of shape (N, 2) with the points to search at.
+            k: Number of objects to return per point.
+            include_center: As in get_nearest.
+
+        Returns:
+            A list with the list of nearest objects of each point.
+
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        cell_x, cell_y = self._points_to_cells(points)
+        cell_size = min(self.cell_width, self.cell_height)
+        span = max(self.grid_width, self.grid_height)
+        results = [None] * len(points)
+        # The points still searching; each round grows all their windows.
+        active = np.arange(len(points))
+        r = 0
+        while len(active):
+            owners, candidates = self._windows(
+                cell_x[active] - r, cell_x[active] + r,
+                cell_y[active] - r, cell_y[active] + r)
+            offsets = self._offsets(points[active][owners],
+                                    self._agent_points[candidates])
+            dists = np.sqrt(np.einsum("ij,ij->i", offsets, offsets))
+            if not include_center:
+                owners = owners[dists > 0]
+                candidates = candidates[dists > 0]
+                dists = dists[dists > 0]
+            # Sort each point's candidates by distance, ties in window order.
+            order = np.lexsort((dists, owners))
+            owners, candidates = owners[order], candidates[order]
+            dists = dists[order]
+            counts = np.bincount(owners, minlength=len(active))
+            group_starts = np.cumsum(counts) - counts
+            if r >= span:
+                done = np.ones(len(active), dtype=bool)
+            else:
+                kth = np.full(len(active), np.inf)
+                enough = counts >= k
+                kth[enough] = dists[group_starts[enough] + k - 1]
+                done = kth <= r * cell_size
+            for window in np.flatnonzero(done).tolist():
+                results[active[window]] = []
+            ranks = np.arange(len(owners)) - group_starts[owners]
+            taken = done[owners] & (ranks < k)
+            for window, i in zip(owners[taken].tolist(),
+                                 candidates[taken].tolist()):
+                results[active[window]].append(self._index_to_agent[i])
+            active = active[~done]
+            r = 2 * r if r else 1
+        return results
 
     def get_heading(self, pos_1, pos_2):
-        one = np.array(pos_1)
-        two = np.array(pos_2)
-        if self.torus:
-            one = (one - self.center) % self.size
-            two = (two - self.center) % self.size
-        heading = two - one
+        """ Get the heading vector from one point to another, accounting for
+        toroidal space.
+
+        On a torus, this is the shortest way around.
+
+        Args:
+            pos_1, pos_2: Coordinate tuples for both points.
+
+        """
+        heading = self._offsets(pos_1, np.asarray(pos_2, dtype=float))
         if isinstance(pos_1, tuple):
             heading = tuple(heading)
         return heading
 
+    def get_headings(self, pos_1, pos_2):
+        """ Get the heading vectors between many points at once, accounting
+        for toroidal space.
+
+        Args:
+            pos_1: A coordinate tuple, or an array-like of shape (N, 2).
+            pos_2: An array-like of shape (M, 2).
+
+        Returns:
+            An (M, 2) array of headings from pos_1 to each point of pos_2 if
+            pos_1 is a single point, or an (N, M, 2) array of headings from
+            each point of pos_1 to each point of pos_2.
+
+        """
+        one = np.asarray(pos_1, dtype=float)
+        two = np.asarray(pos_2, dtype=float).reshape(-1, 2)
+        if one.ndim == 1:
+            return self._offsets(one, two)
+        return self._offsets(one.reshape(-1, 1, 2), two.reshape(1, -1, 2))
+
     def get_distance(self, pos_1, pos_2):
         """ Get the distance between two point, accounting for toroidal space.
 
+        On a torus, this is the length of the shortest way around.
+
         Args:
             pos_1, pos_2: Coordinate tuples for both points.
 
         """
-        pos_1 = np.array(pos_1)
-        pos_2 = np.array(pos_2)
-        if self.torus:
-            pos_1 = (pos_1 - self.center) % self.size
-            pos_2 = (pos_2 - self.center) % self.size
-        return np.linalg.norm(pos_1 - pos_2)
+        dx, dy = self._offsets(pos_1, np.asarray(pos_2, dtype=float))
+        return math.sqrt(dx * dx + dy * dy)
+
+    def get_distances(self, pos_1, pos_2):
+        """ Get the distances between many points at once, accounting for
+        toroidal space.
+
+        Args:
+            pos_1: A coordinate tuple, or an array-like of shape (N, 2).
+            pos_2: An array-like of shape (M, 2).
+
+        Returns:
+            An (M,) array of distances from pos_1 to each point of pos_2 if
+            pos_1 is a single point, or an (N, M) distance matrix.
+
+        """
+        headings = self.get_headings(pos_1, pos_2)
+        return np.sqrt(np.einsum("...i,...i->...", headings, headings))
 
     def torus_adj(self, pos):
         """ Adjust coordinates to handle torus looping.
@@ -595,18 +2208,194 @@ class ContinuousSpace:
             else:
                 return np.array((x, y))
 
-    def _point_to_cell(self, pos):
-        """ Get the cell coordinates that a given x,y point falls in. """
-        if self.out_of_bounds(pos):
-            raise Exception("Point out of bounds.")
-
-        x, y = pos
-        cell_x = math.floor((x - self.x_min) / self.cell_width)
-        cell_y = math.floor((y - self.y_min) / self.cell_height)
-        return (cell_x, cell_y)
-
     def out_of_bounds(self, pos):
         """ Check if a point is out of bounds. """
         x, y = pos
         return (x < self.x_min or x >= self.x_max or
                 y < self.y_min or y >= self.y_max)
+
+
+class NetworkSpace:
+    """ Space where agents sit on the nodes of a graph.
+
+    Nodes are the integers 0 to num_nodes - 1, and each one holds a list of
+    agents. The edges are stored in compressed sparse row (CSR) form: the
+    neighbors of node n are indices[indptr[n]:indptr[n + 1]], so the space
+    costs a few bytes per edge and neighborhood queries expand whole
+    frontiers with array operations.
+
+    The methods get_node_neighbors, edge_weight and node_distance have the
+    signatures astar.find_path expects, e.g.
+
+        find_path(start, goal, space.get_node_neighbors,
+                  heuristic_cost_estimate_fnct=space.node_distance,
+                  distance_between_fnct=space.edge_weight)
+
+    A* only returns shortest paths if node_distance never overestimates
+    the remaining cost, so when positions are given the weights must be at
+    least the straight-line lengths of their edges. Without weights, where
+    every edge costs 1, node_distance returns 0 and A* falls back to a
+    plain shortest-path search.
+
+    Properties:
+        num_nodes: Number of nodes.
+        directed: Whether edges only lead from their first to their second
+                  node.
+        indptr, indices: The CSR adjacency arrays.
+        weights: NumPy float array with the weight of each entry of indices,
+                 or None if every edge weighs 1.
+        positions: NumPy (num_nodes, 2) array with the coordinates of the
+                   nodes, or None.
+
+    """
+    def __init__(self, edges, num_nodes=None, directed=False, weights=None,
+                 positions=None):
+        """ Create a new network space.
+
+        Args:
+            edges: Array-like of (node, node) pairs. Repeated edges are kept
+                   once.
+            num_nodes: Number of nodes; by default one more than the largest
+                       node in edges, or the number of positions.
+            directed: Boolean whether edges are one-way.
+            weights: Optional array-like with the weight of each edge.
+            positions: Optional array-like of (x, y) node coordinates, used
+                       by node_distance.
+
+        """
+        edges = np.asarray(edges, dtype=int).reshape(-1, 2)
+        if positions is not None:
+            positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        if num_nodes is None:
+            if positions is not None:
+                num_nodes = len(positions)
+            else:
+                num_nodes = int(edges.max()) + 1 if len(edges) else 0
+        if len(edges) and (edges.min() < 0 or edges.max() >= num_nodes):
+            raise Exception("ERROR: Edge to a node which does not exist")
+        if weights is not None:
+            weights = np.asarray(weights, dtype=float).reshape(-1)
+            if len(weights) != len(edges):
+                raise Exception("ERROR: Need exactly one weight per edge")
+
+        sources, targets = edges[:, 0], edges[:, 1]
+        if not directed:
+            sources, targets = (np.concatenate([sources, targets]),
+                                np.concatenate([targets, sources]))
+            if weights is not None:
+                weights = np.concatenate([weights, weights])
+        # Sort by source then target, keeping the first of repeated edges.
+        _, first = np.unique(sources * num_nodes + targets, return_index=True)
+        sources, targets = sources[first], targets[first]
+
+        self.num_nodes = num_nodes
+        self.directed = directed
+        self.indptr = np.zeros(num_nodes + 1, dtype=int)
+        np.cumsum(np.bincount(sources, minlength=num_nodes),
+                  out=self.indptr[1:])
+        self.indices = targets
+        self.weights = None if weights is None else weights[first]
+        self.positions = positions
+        self._nodes = [[] for _ in range(num_nodes)]
+
+    def place_agent(self, agent, node):
+        """ Place an agent on a node, and set its pos variable. """
+        self._place_agent(node, agent)
+        agent.pos = node
+
+    def move_agent(self, agent, node):
+        """ Move an agent from its current node to a new one. """
+        self._remove_agent(agent.pos, agent)
+        self._place_agent(node, agent)
+        agent.pos = node
+
+    def remove_agent(self, agent):
+        """ Remove the agent from the space and set its pos variable to None.
+        """
+        self._remove_agent(agent.pos, agent)
+        agent.pos = None
+
+    def _place_agent(self, node, agent):
+        """ Place the agent at the correct node. """
+        self._nodes[node].append(agent)
+
+    def _remove_agent(self, node, agent):
+        """ Remove the agent from the given node. """
+        self._nodes[node].remove(agent)
+
+    def is_cell_empty(self, node):
+        """ Returns a bool of the contents of a node. """
+        return not self._nodes[node]
+
+    def iter_cell_list_contents(self, node_list):
+        """ Returns an iterator of the agents on the given nodes. """
+        nodes = self._nodes
+        return itertools.chain.from_iterable(nodes[node] for node in node_list)
+
+    def get_cell_list_contents(self, node_list):
+        """ Returns a list of the agents on the given nodes. """
+        return list(self.iter_cell_list_contents(node_list))
+
+    def get_node_neighbors(self, node):
+        """ Returns a list of the nodes an edge leads to from node. """
+        return self.indices[self.indptr[node]:self.indptr[node + 1]].tolist()
+
+    def get_neighborhood(self, node, radius=1, include_center=False):
+        """ Return the nodes at most radius edges away from a node.
+
+        Each hop expands the whole frontier at once, by gathering the CSR
+        rows of its nodes and dropping those already reached.
+
+        Args:
+            node: Node to start from.
+            radius: Maximum number of edges to follow.
+            include_center: If True, return the node itself as well.
+
+        Returns:
+            A list of nodes, ordered by hop count and then by node.
+
+        """
+        reached = np.zeros(self.num_nodes, dtype=bool)
+        reached[node] = True
+        frontier = np.array([node])
+        found = [frontier] if include_center else []
+        for _ in range(radius):
+            rows = _concat_ranges(self.indptr[frontier],
+                                  self.indptr[frontier + 1])
+            frontier = np.unique(self.indices[rows])
+            frontier = frontier[~reached[frontier]]
+            if not len(frontier):
+                break
+            reached[frontier] = True
+            found.append(frontier)
+        if not found:
+            return []
+        return np.concatenate(found).tolist()
+
+    def iter_neighbors(self, node, radius=1, include_center=False):
+        """ Return an iterator over the agents at most radius edges away
+        from a node. See get_neighborhood. """
+        return self.iter_cell_list_contents(
+            self.get_neighborhood(node, radius, include_center))
+
+    def get_neighbors(self, node, radius=1, include_center=False):
+        """ Return a list of the agents at most radius edges away from a
+        node. See get_neighborhood. """
+        return list(self.iter_neighbors(node, radius, include_center))
+
+    def edge_weight(self, node_1, node_2):
+        """ Returns the weight of the edge from node_1 to node_2. """
+        start, end = self.indptr[node_1], self.indptr[node_1 + 1]
+        offset = start + np.searchsorted(self.indices[start:end], node_2)
+        if offset == end or self.indices[offset] != node_2:
+            raise Exception("ERROR: No edge between these nodes")
+        return 1.0 if self.weights is None else float(self.weights[offset])
+
+    def node_distance(self, node_1, node_2):
+        """ Returns the straight-line distance between two nodes, or 0 if
+        the nodes have no positions or the edges no weights (as it would
+        then not be comparable with the edge costs). """
+        if self.positions is None or self.weights is None:
+            return 0.0
+        dx, dy = self.positions[node_1] - self.positions[node_2]
+        return math.hypot(dx, dy)
@@ -22,11 +22,145 @@ Key concepts:
     model has taken.
 
 
-TODO: Have the schedulers use the model's randomizer, to keep random number
-seeds consistent and allow for replication.
+Random orders are drawn from a NumPy generator owned by each scheduler. It is
+seeded from Python's random module unless a seed is given, so seeding the
+model (or calling random.seed) still makes runs reproducible.
 
 """
+import heapq
+import itertools
+import multiprocessing
+import os
 import random
+import time
+
+import numpy as np
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # Python < 3.8: snapshots are pickled instead.
+    shared_memory = None
+
+
+class _AgentRegistry:
+    """ The agents of a schedule, in a deterministic order.
+
+    Agents are kept in a list of slots, with a dict from unique_id to slot,
+    so adding, removing and looking up an agent are O(1). Removal leaves a
+    hole, and holes are squeezed out, preserving order, the next time the
+    list is iterated by position. While a step is running, removals are
+    held back until it ends, so the schedulers can walk the slots in place,
+    directly or through a permutation of the slot indices.
+
+    Supports len, iteration, indexing and `in`, like the list it replaces.
+
+    """
+    def __init__(self):
+        self._slots = []
+        self._slots_by_id = {}
+        self._holes = 0
+        # unique_id -> agent removed during the running step, or None.
+        self._pending = None
+        # Slot indices, reshuffled in place for each random order.
+        self._order = np.arange(0)
+
+    def add(self, agent):
+        """ Add an agent at the end of the order. """
+        unique_id = agent.unique_id
+        if self._pending and self._pending.get(unique_id) is agent:
+            del self._pending[unique_id]
+            return
+        if unique_id in self._slots_by_id:
+            raise Exception("ERROR: An agent with unique_id {} is already "
+                            "scheduled".format(unique_id))
+        self._slots_by_id[unique_id] = len(self._slots)
+        self._slots.append(agent)
+
+    def remove(self, agent):
+        """ Remove an agent, if it is in the registry. """
+        unique_id = agent.unique_id
+        slot = self._slots_by_id.get(unique_id)
+        if slot is None or self._slots[slot] is not agent:
+            return
+        if self._pending is not None:
+            self._pending[unique_id] = agent
+            return
+        del self._slots_by_id[unique_id]
+        self._slots[slot] = None
+        self._holes += 1
+
+    def get(self, unique_id, default=None):
+        """ Return the agent with a given unique_id. """
+        slot = self._slots_by_id.get(unique_id)
+        return default if slot is None else self._slots[slot]
+
+    def begin_step(self):
+        """ Start holding back removals. """
+        self._compact()
+        self._pending = {}
+
+    def end_step(self):
+        """ Apply the removals held back since begin_step. """
+        pending, self._pending = self._pending, None
+        for agent in pending.values():
+            self.remove(agent)
+
+    def current(self, start=0, stop=None):
+        """ Iterate over the agents in the registry now, in order, from the
+        given slot on, leaving out any added during the iteration. Only valid
+        during a step. """
+        if stop is None:
+            stop = len(self._slots)
+        return itertools.islice(self._slots, start, stop)
+
+    def slot_count(self):
+        """ Return the number of slots, which during a step only grows. """
+        return len(self._slots)
+
+    def permutation(self, rng, count=None):
+        """ Draw a random order of the agents in the registry now, or of the
+        first count slots.
+
+        The slots themselves are not reordered; the order is a NumPy array
+        of slot indices, shuffled in place in a buffer which is only
+        reallocated when the number of agents changes. Only valid during a
+        step, and until the next call.
+
+        """
+        if count is None:
+            count = len(self._slots)
+        if len(self._order) != count:
+            self._order = np.arange(count)
+        rng.shuffle(self._order)
+        return self._order
+
+    def take(self, order):
+        """ Iterate over the agents in the given order of slot indices. """
+        slots = self._slots
+        for slot in order.tolist():
+            yield slots[slot]
+
+    def _compact(self):
+        """ Squeeze the holes out of the slots, preserving order. """
+        if not self._holes:
+            return
+        self._slots = [agent for agent in self._slots if agent is not None]
+        self._slots_by_id = {agent.unique_id: slot
+                             for slot, agent in enumerate(self._slots)}
+        self._holes = 0
+
+    def __len__(self):
+        return len(self._slots) - self._holes
+
+    def __iter__(self):
+        return (agent for agent in self._slots if agent is not None)
+
+    def __getitem__(self, index):
+        self._compact()
+        return self._slots[index]
+
+    def __contains__(self, agent):
+        return self.get(agent.unique_id) is agent
 
 
 class BaseScheduler:
@@ -37,13 +171,42 @@ class BaseScheduler:
 
     (This is explicitly meant to replicate the scheduler in MASON).
 
+    Agents are kept in a registry keyed by unique_id, which must be unique
+    within the schedule. Agents removed during a step stay in the schedule
+    until the step ends; agents added during a step are first activated on
+    the next one.
+
+    An agent class can also define a classmethod step_batch(agents) (or,
+    for other activation methods, e.g. advance, advance_batch). Its agents
+    are then not stepped one by one: they are collected in activation
+    order and passed to it in a single call, after the agents of the other
+    classes.
+
     """
-    def __init__(self, model):
-        """ Create a new, empty BaseScheduler. """
+    def __init__(self, model, seed=None):
+        """ Create a new, empty BaseScheduler.
+
+        Args:
+            model: Model object associated with the schedule.
+            seed: Seed for the scheduler's random number generator, rng. By
+                  default it is drawn from Python's random module.
+
+        """
         self.model = model
         self.steps = 0
         self.time = 0
-        self.agents = []
+        self._agents = _AgentRegistry()
+        # (class, method name) -> the class's batch method, or None.
+        self._batch_methods = {}
+        if seed is None:
+            seed = random.getrandbits(64)
+        self.rng = np.random.default_rng(seed)
+
+    @property
+    def agents(self):
+        """ The scheduled agents, in activation order. Supports len,
+        iteration and indexing; use add and remove to change it. """
+        return self._agents
 
     def add(self, agent):
         """ Add an Agent object to the schedule.
@@ -53,28 +216,62 @@ class BaseScheduler:
             have a step() method.
 
         """
-        self.agents.append(agent)
+        self._agents.add(agent)
 
     def remove(self, agent):
-        """ Remove all instances of a given agent from the schedule.
+        """ Remove a given agent from the schedule.
 
         Args:
             agent: An agent object.
 
         """
-        while agent in self.agents:
-            self.agents.remove(agent)
+        self._agents.remove(agent)
+
+    def get_agent(self, unique_id, default=None):
+        """ Returns the scheduled agent with a given unique_id. """
+        return self._agents.get(unique_id, default)
 
     def step(self):
         """ Execute the step of all the agents, one at a time. """
-        for agent in self.agents[:]:
-            agent.step()
+        self._agents.begin_step()
+        self._activate(self._agents.current())
+        self._agents.end_step()
         self.steps += 1
         self.time += 1
 
+    def _batch_method(self, agent_class, method):
+        """ Return the batch version of a method for a class, or None. """
+        key = (agent_class, method)
+        try:
+            return self._batch_methods[key]
+        except KeyError:
+            batch = getattr(agent_class, method + "_batch", None)
+            self._batch_methods[key] = batch
+            return batch
+
+    def _activate(self, agents, method="step"):
+        """ Call a method of each agent, in order, with one call per class
+        for the classes which have a batch version of it. """
+        batch_methods = self._batch_methods
+        batches = None
+        for agent in agents:
+            agent_class = type(agent)
+            batch = batch_methods.get((agent_class, method), False)
+            if batch is False:
+                batch = self._batch_method(agent_class, method)
+            if batch is None:
+                getattr(agent, method)()
+            else:
+                if batches is None:
+                    batches = {}
+                batches.setdefault(agent_class, []).append(agent)
+        if batches:
+            for agent_class, group in batches.items():
+                batch_methods[agent_class, method](group)
+
     def get_agent_count(self):
         """ Returns the current number of agents in the queue. """
-        return len(self.agents)
+        return len(self._agents)
 
 
 class RandomActivation(BaseScheduler):
@@ -92,9 +289,10 @@ class RandomActivation(BaseScheduler):
         random order.
 
         """
-        random.shuffle(self.agents)
-        for agent in self.agents[:]:
-            agent.step()
+        agents = self._agents
+        agents.begin_step()
+        self._activate(agents.take(agents.permutation(self.rng)))
+        agents.end_step()
         self.steps += 1
         self.time += 1
 
@@ -109,10 +307,10 @@ class SimultaneousActivation(BaseScheduler):
     """
     def step(self):
         """ Step all agents, then advance them. """
-        for agent in self.agents[:]:
-            agent.step()
-        for agent in self.agents[:]:
-            agent.advance()
+        self._agents.begin_step()
+        self._activate(self._agents.current())
+        self._activate(self._agents.current(), "advance")
+        self._agents.end_step()
         self.steps += 1
         self.time += 1
 
@@ -130,7 +328,7 @@ class StagedActivation(BaseScheduler):
 
     """
     def __init__(self, model, stage_list=None, shuffle=False,
-                 shuffle_between_stages=False):
+                 shuffle_between_stages=False, seed=None):
         """ Create an empty Staged Activation schedule.
 
         Args:
@@ -141,9 +339,10 @@ class StagedActivation(BaseScheduler):
             shuffle_between_stages: If True, shuffle the agents after each
                                     stage; otherwise, only shuffle at the start
                                     of each step.
+            seed: Seed for the scheduler's random number generator.
 
         """
-        super().__init__(model)
+        super().__init__(model, seed)
         self.stage_list = ["step"] if not stage_list else stage_list
         self.shuffle = shuffle
         self.shuffle_between_stages = shuffle_between_stages
@@ -151,13 +350,534 @@ class StagedActivation(BaseScheduler):
 
     def step(self):
         """ Executes all the stages for all agents. """
-        if self.shuffle:
-            random.shuffle(self.agents)
+        agents = self._agents
+        agents.begin_step()
+        order = agents.permutation(self.rng) if self.shuffle else None
         for stage in self.stage_list:
-            for agent in self.agents[:]:
-                getattr(agent, stage)()  # Run stage
+            if order is None:
+                stage_agents = agents.current()
+            else:
+                # Agents added by earlier stages go last.
+                stage_agents = itertools.chain(agents.take(order),
+                                               agents.current(len(order)))
+            self._activate(stage_agents, stage)  # Run stage
             if self.shuffle_between_stages:
-                random.shuffle(self.agents)
+                order = agents.permutation(self.rng)
             self.time += self.stage_time
+        agents.end_step()
+
+        self.steps += 1
+
 
+class RandomActivationByType(BaseScheduler):
+    """ A scheduler which activates agents one class at a time.
+
+    Agents are partitioned by their exact class. Each step, the classes are
+    activated in turn: first those in phase_order, in that order, then the
+    rest in the order their first agent was added. Within a class, agents are
+    activated in a random order (or in the order added, if shuffle is False).
+    Classes whose passive attribute is true are skipped altogether, so inert
+    agents such as markers cost nothing per step.
+
+    With interleave, the classes are not activated in turn: the agents of
+    all the active classes are activated in a single random order, as
+    RandomActivation would, only without the passive ones. type_time is then
+    not kept, as no time is spent per class.
+
+    Properties:
+        agents_by_type: Dictionary mapping each class to the registry of its
+                        agents.
+        type_steps: Dictionary mapping each class to the number of agent
+                    activations so far.
+        type_time: Dictionary mapping each class to the seconds spent in its
+                   agents' step methods so far.
+
+    """
+    def __init__(self, model, phase_order=(), shuffle=True, seed=None,
+                 interleave=False):
+        """ Create an empty type-partitioned schedule.
+
+        Args:
+            model: Model object associated with the schedule.
+            phase_order: Classes to activate first, in this order.
+            shuffle: If True, shuffle the agents of each class every step.
+            seed: Seed for the scheduler's random number generator.
+            interleave: If True, activate the agents of all the active
+                        classes in one order, shuffled if shuffle is True.
+
+        """
+        super().__init__(model, seed)
+        self.phase_order = list(phase_order)
+        self.shuffle = shuffle
+        self.interleave = interleave
+        self.agents_by_type = {}
+        self.type_steps = {}
+        self.type_time = {}
+
+    def add(self, agent):
+        """ Add an Agent object to the schedule, under its class. """
+        super().add(agent)
+        agent_class = type(agent)
+        if agent_class not in self.agents_by_type:
+            self.agents_by_type[agent_class] = _AgentRegistry()
+            self.type_steps[agent_class] = 0
+            self.type_time[agent_class] = 0.0
+        self.agents_by_type[agent_class].add(agent)
+
+    def remove(self, agent):
+        """ Remove a given agent from the schedule. """
+        super().remove(agent)
+        registry = self.agents_by_type.get(type(agent))
+        if registry is not None:
+            registry.remove(agent)
+
+    def _phases(self):
+        """ Return the classes to activate this step, in order. """
+        phases = [agent_class for agent_class in self.phase_order
+                  if agent_class in self.agents_by_type]
+        phases.extend(agent_class for agent_class in self.agents_by_type
+                      if agent_class not in self.phase_order)
+        return [agent_class for agent_class in phases
+                if not getattr(agent_class, "passive", False)]
+
+    def step(self):
+        """ Executes the step of each class of agents in turn, one agent at
+        a time. """
+        self._agents.begin_step()
+        registries = list(self.agents_by_type.values())
+        for registry in registries:
+            registry.begin_step()
+        # Only the agents there now are activated: classes and agents added
+        # by earlier phases wait for the next step.
+        phases = [(agent_class, self.agents_by_type[agent_class].slot_count())
+                  for agent_class in self._phases()]
+        if self.interleave:
+            self._step_interleaved(phases)
+        else:
+            self._step_phases(phases)
+        for registry in registries:
+            registry.end_step()
+        self._agents.end_step()
         self.steps += 1
+        self.time += 1
+
+    def _step_phases(self, phases):
+        """ Activate each phase's first slots of agents in turn. """
+        for agent_class, slots in phases:
+            registry = self.agents_by_type[agent_class]
+            if self.shuffle:
+                agents = registry.take(registry.permutation(self.rng, slots))
+            else:
+                agents = registry.current(0, slots)
+            start = time.perf_counter()
+            batch = self._batch_method(agent_class, "step")
+            if batch is None:
+                count = 0
+                for agent in agents:
+                    agent.step()
+                    count += 1
+            else:
+                agents = list(agents)
+                count = len(agents)
+                batch(agents)
+            self.type_time[agent_class] += time.perf_counter() - start
+            self.type_steps[agent_class] += count
+
+    def _step_interleaved(self, phases):
+        """ Activate the agents of all the phases in a single order. """
+        agents = []
+        for agent_class, slots in phases:
+            agents.extend(self.agents_by_type[agent_class].current(0, slots))
+            self.type_steps[agent_class] += slots
+        if self.shuffle:
+            self.rng.shuffle(agents)
+        self._activate(agents)
+
+    def get_type_count(self, agent_class):
+        """ Returns the current number of agents of a given class. """
+        registry = self.agents_by_type.get(agent_class)
+        return 0 if registry is None else len(registry)
+
+
+class DiscreteEventScheduler(BaseScheduler):
+    """ A scheduler which only activates agents when they are due.
+
+    Each agent has a wake-up time in a priority queue. A step activates the
+    agents due at the current time, then advances the time by 1, as with the
+    other schedulers. An agent which does nothing about it is due again on
+    the next step; one which calls sleep, sleep_until or wake is not
+    activated, and costs nothing, until then. This suits agents with
+    countdowns or long idle spells.
+
+    Agents due in the same step are activated in the order of their wake-up
+    times and then of scheduling, or in a random order if shuffle is True.
+    Removed agents are not activated again. Since each agent is rescheduled
+    after its own step, step_batch methods are not used.
+
+    """
+    def __init__(self, model, shuffle=False, seed=None):
+        """ Create an empty discrete-event schedule.
+
+        Args:
+            model: Model object associated with the schedule.
+            shuffle: If True, shuffle the agents due in each step.
+            seed: Seed for the scheduler's random number generator.
+
+        """
+        super().__init__(model, seed)
+        self.shuffle = shuffle
+        # Heap of (time, sequence, unique_id); entries which no longer match
+        # _wake_ups are stale and dropped when popped.
+        self._queue = []
+        self._wake_ups = {}
+        self._sequence = itertools.count()
+        self._running = False
+
+    def add(self, agent):
+        """ Add an Agent object to the schedule, due at the next step. """
+        super().add(agent)
+        self.sleep_until(agent, self.time)
+
+    def remove(self, agent):
+        """ Remove a given agent from the schedule, cancelling its wake-up.
+        """
+        super().remove(agent)
+        self._wake_ups.pop(agent.unique_id, None)
+
+    def sleep_until(self, agent, wake_time):
+        """ Set when an agent is next activated, replacing its previous
+        wake-up.
+
+        Args:
+            agent: A scheduled agent.
+            wake_time: Time of the step to activate it in; times already
+                       reached mean the next step. None to sleep until woken.
+
+        """
+        if wake_time is None:
+            self._wake_ups.pop(agent.unique_id, None)
+            return
+        earliest = self.time + 1 if self._running else self.time
+        entry = (max(wake_time, earliest), next(self._sequence),
+                 agent.unique_id)
+        self._wake_ups[agent.unique_id] = entry
+        heapq.heappush(self._queue, entry)
+
+    def sleep(self, agent, duration):
+        """ Skip an agent's activations for the given number of steps. """
+        self.sleep_until(agent, self.time + 1 + duration)
+
+    def wake(self, agent):
+        """ Activate a sleeping agent in the next step. """
+        self.sleep_until(agent, self.time)
+
+    def next_wake_time(self, agent):
+        """ Returns the time an agent is next due, or None. """
+        entry = self._wake_ups.get(agent.unique_id)
+        return None if entry is None else entry[0]
+
+    def _pop_due(self):
+        """ Pop the agents due by the current time, in queue order. """
+        queue, wake_ups = self._queue, self._wake_ups
+        due = []
+        while queue and queue[0][0] <= self.time:
+            entry = heapq.heappop(queue)
+            if wake_ups.get(entry[2]) is entry:
+                due.append(entry)
+        return due
+
+    def step(self):
+        """ Executes the step of the agents due now. """
+        self._running = True
+        self._agents.begin_step()
+        due = self._pop_due()
+        if self.shuffle and len(due) > 1:
+            due = [due[index] for index in self.rng.permutation(len(due))]
+        wake_ups = self._wake_ups
+        for entry in due:
+            unique_id = entry[2]
+            # Skip agents removed or rescheduled by earlier agents.
+            if wake_ups.get(unique_id) is not entry:
+                continue
+            agent = self._agents.get(unique_id)
+            agent.step()
+            if wake_ups.get(unique_id) is entry:
+                self.sleep_until(agent, self.time + 1)
+        self._agents.end_step()
+        self._running = False
+        self.steps += 1
+        self.time += 1
+
+
+class SampledActivation(BaseScheduler):
+    """ A scheduler which activates each agent with its own probability.
+
+    Agents expose an activation_probability attribute (1 if missing), read
+    when they are added and copied into a NumPy array. Each step draws one
+    Bernoulli mask over the whole array and calls step only on the agents
+    it selects, in a random order, so agents pay nothing on the steps they
+    sit out and their step method need not roll the dice itself.
+
+    Call update_activation_probability after changing an agent's
+    activation_probability.
+
+    """
+    def __init__(self, model, shuffle=True, seed=None):
+        """ Create an empty sampled-activation schedule.
+
+        Args:
+            model: Model object associated with the schedule.
+            shuffle: If True, activate the selected agents in a random order;
+                     otherwise in the order they were added.
+            seed: Seed for the scheduler's random number generator.
+
+        """
+        super().__init__(model, seed)
+        self.shuffle = shuffle
+        # Agents and their probabilities, in matching slots; removal moves
+        # the last agent into the freed slot.
+        self._members = []
+        self._slots_by_id = {}
+        self._probabilities = np.zeros(16)
+        self._removals = None
+
+    def add(self, agent):
+        """ Add an Agent object to the schedule. """
+        super().add(agent)
+        if self._removals and self._removals.get(agent.unique_id) is agent:
+            # Removed and re-added in the same step: it keeps its slot.
+            del self._removals[agent.unique_id]
+            return
+        slot = len(self._members)
+        if slot == len(self._probabilities):
+            self._probabilities = np.concatenate(
+                [self._probabilities, np.zeros(slot)])
+        self._members.append(agent)
+        self._slots_by_id[agent.unique_id] = slot
+        self._probabilities[slot] = getattr(agent, "activation_probability",
+                                            1.0)
+
+    def remove(self, agent):
+        """ Remove a given agent from the schedule. """
+        super().remove(agent)
+        if self._removals is not None:
+            if agent.unique_id in self._slots_by_id:
+                self._removals[agent.unique_id] = agent
+            return
+        slot = self._slots_by_id.pop(agent.unique_id, None)
+        if slot is None:
+            return
+        last = self._members.pop()
+        if last is not agent:
+            self._members[slot] = last
+            self._slots_by_id[last.unique_id] = slot
+            self._probabilities[slot] = self._probabilities[
+                len(self._members)]
+
+    def update_activation_probability(self, agent, probability=None):
+        """ Set the probability an agent is activated with each step.
+
+        Args:
+            agent: A scheduled agent.
+            probability: The new probability; by default the agent's
+                         activation_probability attribute.
+
+        """
+        if probability is None:
+            probability = getattr(agent, "activation_probability", 1.0)
+        self._probabilities[self._slots_by_id[agent.unique_id]] = probability
+
+    def step(self):
+        """ Executes the step of a random sample of the agents. """
+        self._agents.begin_step()
+        self._removals = {}
+        count = len(self._members)
+        selected = np.flatnonzero(self.rng.random(count) <
+                                  self._probabilities[:count])
+        if self.shuffle:
+            self.rng.shuffle(selected)
+        members = self._members
+        self._activate(members[slot] for slot in selected.tolist())
+        removals, self._removals = self._removals, None
+        for agent in removals.values():
+            self.remove(agent)
+        self._agents.end_step()
+        self.steps += 1
+        self.time += 1
+
+
+# Shared memory blocks a worker process has attached to, by name.
+_attached_blocks = {}
+
+
+def _read_only(array):
+    """ Return a read-only view of an array. """
+    view = np.asarray(array).view()
+    view.flags.writeable = False
+    return view
+
+
+def _attach_block(name):
+    """ Attach to a shared memory block owned by the parent process. """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching registers the block for cleanup, as
+        # if this process owned it; only the parent should unlink it.
+        block = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(block._name, "shared_memory")
+        return block
+
+
+def _attach_snapshot(spec):
+    """ Rebuild, in a worker, the snapshot described by spec. """
+    snapshot = {}
+    for key, (kind, data, shape, dtype) in spec.items():
+        if kind == "shared":
+            block = _attached_blocks.get(data)
+            if block is None:
+                block = _attached_blocks[data] = _attach_block(data)
+            data = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        snapshot[key] = _read_only(data)
+    return snapshot
+
+
+def _decide_chunk(task):
+    """ Run decide for a chunk of agent states in a worker process. """
+    spec, items = task
+    snapshot = _attach_snapshot(spec)
+    return [decide(state, snapshot) for decide, state in items]
+
+
+class ParallelSimultaneousActivation(SimultaneousActivation):
+    """ SimultaneousActivation with the decision phase run in worker
+    processes.
+
+    Agents taking part define:
+        get_state(): Returns a small picklable summary of the agent.
+        decide(state, snapshot): A staticmethod (or other module-level
+            function) returning the agent's proposed action, computed only
+            from its state and the read-only snapshot arrays.
+        conflict_key(proposal): Optional staticmethod returning what the
+            proposal claims (e.g. a target cell), or None.
+        advance(): Applies self.proposal, which is None if the agent lost
+            a conflict.
+
+    Each step, the snapshot arrays are copied into shared memory once, the
+    states are split into chunks across a process pool, and the proposals
+    come back in activation order. Of the proposals claiming the same key,
+    the first in that order wins, so results do not depend on the number
+    of processes. advance then runs in the parent. Agents without a decide
+    method use the serial step() and advance() protocol.
+
+    Call close() when done to stop the workers and free the shared memory.
+
+    """
+    def __init__(self, model, processes=None, snapshot=None, shuffle=False,
+                 seed=None):
+        """ Create an empty parallel simultaneous schedule.
+
+        Args:
+            model: Model object associated with the schedule.
+            processes: Number of worker processes; by default one per CPU.
+                       With 1, decide runs in this process.
+            snapshot: Function taking the model and returning a dict of
+                      NumPy arrays (of plain dtypes) for decide to read, e.g.
+                      lambda m: {"occupancy": m.grid.occupancy}.
+            shuffle: If True, draw a random activation order, and so conflict
+                     priority, each step; otherwise use the order added.
+            seed: Seed for the scheduler's random number generator.
+
+        """
+        super().__init__(model, seed)
+        self.processes = processes or os.cpu_count() or 1
+        self.snapshot = snapshot
+        self.shuffle = shuffle
+        self._pool = None
+        self._blocks = {}
+
+    def step(self):
+        """ Decide for all agents in parallel, resolve conflicts, then
+        advance them. """
+        agents = self._agents
+        agents.begin_step()
+        count = len(agents)
+        if self.shuffle:
+            order = list(agents.take(agents.permutation(self.rng)))
+        else:
+            order = list(agents.current())
+        deciders = []
+        others = []
+        for agent in order:
+            if hasattr(type(agent), "decide"):
+                deciders.append(agent)
+            else:
+                others.append(agent)
+        self._activate(others)
+        proposals = self._decide(deciders)
+        claimed = set()
+        for agent, proposal in zip(deciders, proposals):
+            conflict_key = getattr(type(agent), "conflict_key", None)
+            if proposal is not None and conflict_key is not None:
+                key = conflict_key(proposal)
+                if key in claimed:
+                    proposal = None
+                elif key is not None:
+                    claimed.add(key)
+            agent.proposal = proposal
+        self._activate(itertools.chain(order, agents.current(count)),
+                       "advance")
+        agents.end_step()
+        self.steps += 1
+        self.time += 1
+
+    def _decide(self, deciders):
+        """ Return the proposals of the given agents, in order. """
+        snapshot = self.snapshot(self.model) if self.snapshot else {}
+        items = [(type(agent).decide, agent.get_state())
+                 for agent in deciders]
+        if self.processes <= 1 or len(items) < 2:
+            snapshot = {key: _read_only(array)
+                        for key, array in snapshot.items()}
+            return [decide(state, snapshot) for decide, state in items]
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.processes)
+        spec = self._share(snapshot)
+        size = -(-len(items) // (4 * self.processes))
+        tasks = [(spec, items[start:start + size])
+                 for start in range(0, len(items), size)]
+        return list(itertools.chain.from_iterable(
+            self._pool.map(_decide_chunk, tasks)))
+
+    def _share(self, snapshot):
+        """ Copy the snapshot arrays into shared memory, reusing the blocks
+        of the previous step when they are large enough, and return the
+        spec workers rebuild it from. """
+        spec = {}
+        for key, array in snapshot.items():
+            array = np.ascontiguousarray(array)
+            if shared_memory is None or not array.nbytes:
+                spec[key] = ("array", array, array.shape, array.dtype)
+                continue
+            block = self._blocks.get(key)
+            if block is None or block.size < array.nbytes:
+                if block is not None:
+                    block.close()
+                    block.unlink()
+                block = self._blocks[key] = shared_memory.SharedMemory(
+                    create=True, size=array.nbytes)
+            np.ndarray(array.shape, dtype=array.dtype,
+                       buffer=block.buf)[...] = array
+            spec[key] = ("shared", block.name, array.shape, array.dtype.str)
+        return spec
+
+    def close(self):
+        """ Stop the worker processes and free the shared memory. """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        for block in self._blocks.values():
+            block.close()
+            block.unlink()
+        self._blocks = {}
@@ -7,6 +7,7 @@ Module for visualizing model objects in grid cells.
 
 """
 from collections import defaultdict
+import numpy as np
 from mesa.visualization.ModularVisualization import VisualizationElement
 
 
@@ -48,6 +49,8 @@ class CanvasGrid(VisualizationElement):
     Attributes:
         portrayal_method: Function which generates portrayals from objects, as
                           described above.
+        terrain_portrayal: Optional function which generates portrayals from
+                           the grid's terrain values, for blocked cells.
         grid_height, grid_width: Size of the grid to visualize, in cells.
         canvas_height, canvas_width: Size, in pixels, of the grid visualization
                                      to draw on the client.
@@ -57,7 +60,7 @@ class CanvasGrid(VisualizationElement):
     package_includes = ["GridDraw.js", "CanvasModule.js"]
 
     def __init__(self, portrayal_method, grid_width, grid_height,
-                 canvas_width=500, canvas_height=500):
+                 canvas_width=500, canvas_height=500, terrain_portrayal=None):
         """ Instantiate a new CanvasGrid.
 
         Args:
@@ -66,9 +69,13 @@ class CanvasGrid(VisualizationElement):
             grid_width, grid_height: Size of the grid, in cells.
             canvas_height, canvas_width: Size of the canvas to draw in the
                                          client, in pixels. (default: 500x500)
+            terrain_portrayal: function to convert the terrain value of each
+                               blocked cell to a portrayal. (default: None,
+                               terrain is not drawn)
 
         """
         self.portrayal_method = portrayal_method
+        self.terrain_portrayal = terrain_portrayal
         self.grid_width = grid_width
         self.grid_height = grid_height
         self.canvas_width = canvas_width
@@ -82,6 +89,14 @@ class CanvasGrid(VisualizationElement):
 
     def render(self, model):
         grid_state = defaultdict(list)
+        terrain = getattr(model.grid, "terrain", None)
+        if self.terrain_portrayal and terrain is not None:
+            for x, y in zip(*np.nonzero(terrain)):
+                portrayal = self.terrain_portrayal(terrain[x, y])
+                if portrayal:
+                    portrayal["x"] = int(x)
+                    portrayal["y"] = int(y)
+                    grid_state[portrayal["Layer"]].append(portrayal)
         for x in range(model.grid.width):
             for y in range(model.grid.height):
                 cell_objects = model.grid.get_cell_list_contents([(x, y)])
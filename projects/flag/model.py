@@ -13,8 +13,8 @@ import projects.flag.influence_masks as im
 import projects.flag.patrolling as pt
 
 from mesa       import Agent, Model
-from mesa.time  import RandomActivation
-from mesa.space import MultiGrid
+from mesa.time  import RandomActivationByType
+from mesa.space import MultiGrid, GridListener
 from astar      import AStar
 
 from mesa.visualization.UserParam import UserSettableParameter
@@ -55,17 +55,14 @@ def possible_moves(player, pos):
     neighbor_cells = player.model.grid.get_neighborhood(
         pos,
         moore=player.model.moore_neighborhood,
-        include_center=True)
-
-    for neighbor in player.model.grid.neighbor_iter(pos, moore = player.model.moore_neighborhood):
-        if ((isinstance(neighbor, Wall) or
-            isinstance(neighbor, Player) or
-            isinstance(neighbor, FireShot) or
-            (isinstance(neighbor, Flag) and neighbor.team == player.team)) and
-            (neighbor.pos in neighbor_cells)):
-               neighbor_cells.remove(neighbor.pos)
-    
-    return neighbor_cells
+        include_center=True,
+        passable_only=True)
+
+    blocked = player.model.grid.layer_values(blocking_agents, neighbor_cells)
+    own_flag = player.model.team_flag[player.team].pos
+
+    return [cell for cell, n in zip(neighbor_cells, blocked)
+            if cell == pos or not (n or cell == own_flag)]
 
 #############################
 #FUNCTION: Update Orientation
@@ -85,6 +82,29 @@ def get_nearest_agent(agent, list_of_agents):
     distances = numpy.array(distances)
     return(list_of_agents[distances.argmin()])
 
+################################
+#CLASS: Player Influence Listener
+################################
+class PlayerMapListener(GridListener):
+    """
+    Keeps the model's player influence map in step with the players' positions
+    """
+    def __init__(self, model):
+        self.model = model
+
+    def on_place(self, agent, pos):
+        if isinstance(agent, Player):
+            self.model.playermap = im.sum_inf_mask(self.model.playermap, im.player_inf_mask, pos)
+
+    def on_move(self, agent, old_pos, new_pos):
+        if isinstance(agent, Player):
+            self.model.playermap = im.sum_inf_mask(self.model.playermap, -im.player_inf_mask, old_pos)
+            self.model.playermap = im.sum_inf_mask(self.model.playermap, im.player_inf_mask, new_pos)
+
+    def on_remove(self, agent, pos):
+        if isinstance(agent, Player):
+            self.model.playermap = im.sum_inf_mask(self.model.playermap, -im.player_inf_mask, pos)
+
 #########################
 #CLASS: AStar Path Finder
 #########################
@@ -131,24 +151,20 @@ class Player(Agent):
         self.pathfinder = AStarSolver(self)
         self.cover_positions = list(2*numpy.array([(0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, 0), (1, -1), (1, 1)], dtype = numpy.uint8))
         self.model.grid.place_agent(self, position)
-        self.model.playermap = im.sum_inf_mask(self.model.playermap, im.player_inf_mask, self.pos)
         self.fireload = 0
         self.immune = 0
 
     #------------------------->
     #Move to the next position>
     def move(self, next_move):        
-        self.model.playermap = im.sum_inf_mask(self.model.playermap, -im.player_inf_mask, self.pos)        
         self.orientation = (next_move[0] - self.pos[0], next_move[1] - self.pos[1])
         self.model.grid.move_agent(self, next_move)        
-        self.model.playermap = im.sum_inf_mask(self.model.playermap, im.player_inf_mask, self.pos)        
         if self.flag: self.model.grid.move_agent(self.flag, self.pos)
     #Move to the next position<
     #-------------------------<
 
     def find_nearest_enemy(self):
-        distances = numpy.array([manhattan_dist(self.pos, enemy.pos) for enemy in self.model.team_players[(self.team + 1) % 2]])
-        return(self.model.team_players[(self.team + 1) % 2][distances.argmin()])
+        return(self.model.grid.nearest(self.pos, Player, lambda p: p.team != self.team)[0])
 
     #-------------------->
     #Attack Flag Behavior>
@@ -338,10 +354,11 @@ class FireShot(Agent):
                 
                 next_cell_contents = self.model.grid.get_cell_list_contents(self.pos)
                 
+                if not self.model.grid.is_passable(self.pos):
+                    self.crash()
+                
                 for agent in next_cell_contents:
-                    if isinstance(agent, Wall):
-                        self.crash()
-                    elif isinstance(agent, Player) and agent.immune < 0:
+                    if isinstance(agent, Player) and agent.immune < 0:
                         self.crash()
                         agent.lock_countdown = self.model.stoptime
                         if agent.flag:
@@ -360,6 +377,8 @@ class FireShot(Agent):
 ############################
 class Delivery(Agent):
     
+    passive = True
+    
     def __init__(self, unique_id, model, team):
         super().__init__(unique_id, model)
         self.team = team
@@ -367,16 +386,8 @@ class Delivery(Agent):
     def step(self):
         pass
 
-##################
-#CLASS: Wall Agent
-##################
-class Wall(Agent):
-    """An agent that restrict Walker movements"""
-    def __init__(self, unique_id, model):
-        super().__init__(unique_id, model)
-        
-    def step(self):
-        pass
+#Agents that no player can move onto (walls are grid terrain)
+blocking_agents = (Player, FireShot)
 
 ############################################
 #CLASS: Capture the Flag - Agent Based model
@@ -387,7 +398,7 @@ class CaptureFlag(Model):
     """
     
     def __init__(self, width, height, blueOffenseSlider, redOffenseSlider):
-        self.grid = MultiGrid(width, height, False)
+        self.grid = MultiGrid(width, height, False, layer_types=[blocking_agents, Player])
         
         #Parameters
         self.njails = 5
@@ -401,7 +412,7 @@ class CaptureFlag(Model):
         self.immunetime = 5
         self.stoptime = 8
         
-        self.schedule = RandomActivation(self)
+        self.schedule = RandomActivationByType(self, interleave=True)
         self.running = True
 
         self.agent_id = 0
@@ -427,6 +438,7 @@ class CaptureFlag(Model):
         #Influence maps
         self.firemap = numpy.ones((height, width), dtype = int)
         self.playermap = numpy.ones((height, width), dtype = int)
+        self.grid.add_listener(PlayerMapListener(self))
         
         #-----
         #Setup
@@ -455,21 +467,10 @@ class CaptureFlag(Model):
         self.team_flag = []
         
         #Create Walls
-        for i in range(width):
-            w = Wall(self.agent_id, self)
-            self.grid.place_agent(w, (i, 0))
-            self.agent_id += 1
-            w = Wall(self.agent_id, self)
-            self.grid.place_agent(w, (i, height-1))
-            self.agent_id += 1
-            
-        for i in range(1, height - 1):
-            w = Wall(self.agent_id, self)
-            self.grid.place_agent(w, (0, i))
-            self.agent_id += 1
-            w = Wall(self.agent_id, self)
-            self.grid.place_agent(w, (width-1, i))
-            self.agent_id += 1
+        self.grid.set_terrain([(i, 0) for i in range(width)] +
+                              [(i, height-1) for i in range(width)] +
+                              [(0, i) for i in range(1, height - 1)] +
+                              [(width-1, i) for i in range(1, height - 1)])
         
         #Populate Teams
         for team in [0, 1]:
@@ -491,9 +492,9 @@ class CaptureFlag(Model):
             for pos in self.delivery_pos[team]:
                 d = Delivery(self.agent_id, self, team)
                 self.team_deliveries[team].append(d)
-                self.grid.place_agent(d, pos)
                 self.schedule.add(d)
                 self.agent_id += 1
+            self.grid.place_agents(self.team_deliveries[team], self.delivery_pos[team])
     
     def step(self):
         if isinstance(self.blueOffenseSlider, UserSettableParameter):
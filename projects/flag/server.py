@@ -9,7 +9,6 @@ from projects.flag.model import CaptureFlag
 from projects.flag.model import Delivery
 from projects.flag.model import Player
 from projects.flag.model import Flag
-from projects.flag.model import Wall
 from projects.flag.model import FireShot
 
 from mesa.visualization.modules   import CanvasGrid
@@ -71,16 +70,16 @@ def agent_portrayal(agent):
                      "w": 1,
                      "h": 1}
         
-    elif (type(agent) == Wall):
-        
-        portrayal = {"Shape": "rect",
-             "Filled": "true",
-             "Color": "black",
-             "Layer": 2,
-             "w": 1,
-             "h": 1}
-        
     return portrayal
+
+def terrain_portrayal(value):
+    
+    return {"Shape": "rect",
+            "Filled": "true",
+            "Color": "black",
+            "Layer": 2,
+            "w": 1,
+            "h": 1}
         
 width = 40
 height = 27
@@ -90,7 +89,8 @@ blueOffenseSlider = UserSettableParameter("slider", "Blue Attackers", 4, 1, 7, 1
 redOffenseSlider = UserSettableParameter("slider", "Red Attackers", 4, 1, 7, 1)
 
 
-grid = CanvasGrid(agent_portrayal, width, height, pixels*width, pixels*height)
+grid = CanvasGrid(agent_portrayal, width, height, pixels*width, pixels*height,
+                  terrain_portrayal=terrain_portrayal)
 
 server = ModularServer(CaptureFlag,
                        [grid],
@@ -73,16 +73,13 @@ def possible_moves(walker, model):
     neighbor_cells = model.grid.get_neighborhood(
         walker.pos,
         include_center = True,
-        moore=model.moore_neighborhood)
+        moore=model.moore_neighborhood,
+        passable_only = True)
 
-    for neighbor in model.grid.neighbor_iter(walker.pos, moore = model.moore_neighborhood):
-        if ((isinstance(neighbor, Walker) or 
-            isinstance(neighbor, Wall) or 
-            isinstance(neighbor, Entry)) and
-            (neighbor.pos in neighbor_cells)):
-                neighbor_cells.remove(neighbor.pos)
-    
-    return neighbor_cells
+    blocked = model.grid.layer_values(blocking_agents, neighbor_cells)
+
+    return [cell for cell, n in zip(neighbor_cells, blocked)
+            if cell == walker.pos or not n]
 
 ####################
 #CLASS: Walker Agent
@@ -194,17 +191,8 @@ class Exit(Agent):
             self.model.walker_dists.append([f.speed, f.dist])
             self.model.walker_atvcounts.append([f.speed, f.active])
 
-##################
-#CLASS: Wall Agent
-##################
-
-class Wall(Agent):
-    """An agent that restrict Walker movements"""
-    def __init__(self, unique_id, model):
-        super().__init__(unique_id, model)
-        
-    def step(self):
-        pass
+#Agents that no walker can move onto (walls are grid terrain)
+blocking_agents = (Walker, Entry)
     
 ###################
 #CLASS: Metro Model
@@ -218,7 +206,7 @@ class MetroModel(Model):
     """
     def __init__(self, width, height, leftRateSlider, rightRateSlider):
         #Model variables
-        self.grid = MultiGrid(width, height, False)
+        self.grid = MultiGrid(width, height, False, layer_types=[blocking_agents])
         self.schedule = RandomActivation(self)
         self.running = True
         self.removals = []
@@ -250,35 +238,27 @@ class MetroModel(Model):
         for side in entries_y.keys():
             for l in entries_y[side]:
                 e = Entry(self.agent_id, self, side)
-                self.grid.place_agent(e, (entries_x[side], l))
                 self.schedule.add(e)
                 self.entries[side].append(e)
                 self.agent_id += 1
+            self.grid.place_agents(self.entries[side], [(entries_x[side], l) for l in entries_y[side]])
                 
         #Create Exits
         for side in exits_y.keys():
             for l in exits_y[side]:
                 e = Exit(self.agent_id, self, side)
-                self.grid.place_agent(e, (exits_x[side], l))
                 self.schedule.add(e)
                 self.exits[side].append(e)
                 self.agent_id += 1
+            self.grid.place_agents(self.exits[side], [(exits_x[side], l) for l in exits_y[side]])
 
         #Create Walls
-        for i in (range(width)):
-            w = Wall(self.agent_id, self)
-            self.grid.place_agent(w, (i, 0))
-            self.agent_id += 1
-            w = Wall(self.agent_id, self)
-            self.grid.place_agent(w, (i, height-1))
-            self.agent_id += 1
+        self.grid.set_terrain([(i, 0) for i in range(width)] +
+                              [(i, height-1) for i in range(width)])
         
         for side, x in entries_x.items():
-            for i in (range(height)):
-                if ((i not in entries_y[side]) and (i not in exits_y[side])) :
-                    w = Wall(self.agent_id, self)
-                    self.grid.place_agent(w, (x, i))
-                    self.agent_id += 1
+            self.grid.set_terrain([(x, i) for i in range(height)
+                                   if (i not in entries_y[side]) and (i not in exits_y[side])])
                     
         self.entries_pos = {"left": numpy.array([g.pos for g in self.entries["left"]]),
                           "right": numpy.array([g.pos for g in self.entries["right"]])}
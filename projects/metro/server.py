@@ -7,7 +7,6 @@ sys.path.insert(0, "./")
 
 from projects.metro.unidir.model import MetroModel
 from projects.metro.unidir.model import Walker
-from projects.metro.unidir.model import Wall
 from projects.metro.unidir.model import Entry
 from projects.metro.unidir.model import Exit
 
@@ -30,15 +29,6 @@ def agent_portrayal(agent):
                      "Layer": 3,
                      "Color": "red" if agent.source == "right" else "blue"}
     
-    elif (type(agent) == Wall):
-        
-        portrayal = {"Shape": "rect",
-             "Filled": "true",
-             "Color": "black",
-             "Layer": 2,
-             "w": 1,
-             "h": 1}
-    
     elif (type(agent) == Entry):
         
         portrayal = {"Shape": "rect",
@@ -59,6 +49,15 @@ def agent_portrayal(agent):
         
     return portrayal
 
+def terrain_portrayal(value):
+    
+    return {"Shape": "rect",
+            "Filled": "true",
+            "Color": "black",
+            "Layer": 2,
+            "w": 1,
+            "h": 1}
+
 ##################################
 #SETTINGS: global model parameters
 ##################################
@@ -74,7 +73,8 @@ rightRate_slider = UserSettableParameter("slider", "Right Rate", 0.15, 0, 0.70,
 #MODEL: create model instance
 #############################
 
-grid = CanvasGrid(agent_portrayal, width, height, pixels*width, pixels*height)
+grid = CanvasGrid(agent_portrayal, width, height, pixels*width, pixels*height,
+                  terrain_portrayal=terrain_portrayal)
 
 server = ModularServer(MetroModel,
                        [grid],